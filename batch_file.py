@@ -0,0 +1,179 @@
+import json
+import uuid
+import argparse
+from collections import Counter
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import openai_request
+from model import TEMPLATES, OpenAIChatDecoder
+from pipeline import build_samples
+from utils import write_jsonl, load_resume_index, save_resume_index
+from writer import WriterPool
+from fake_backend import fake_completion, is_type_prompt
+
+BATCH_URL = "/v1/chat/completions"
+
+
+def make_custom_id(task_id: str, id_num: int, sample: int) -> str:
+    return f"{task_id}/{id_num}/{sample}"
+
+
+def parse_custom_id(custom_id: str) -> Tuple[str, int, int]:
+    # task_ids such as BigCodeBench/13 contain a slash themselves
+    task_id, id_num, sample = custom_id.rsplit("/", 2)
+    return task_id, int(id_num), int(sample)
+
+
+def manifest_path(batch_path: str) -> str:
+    return batch_path + ".jobs.jsonl"
+
+
+def ingested_path(save_path: str) -> str:
+    return save_path + ".batch-ingested"
+
+
+def write_batch_requests(model: OpenAIChatDecoder, jobs: List[Dict], save_path: str, batch_path: str) -> int:
+    """
+    Writes the pending samples of `jobs` as an OpenAI batch file, one request of up to
+    `model.batch_size` samples per line, with custom_id = task_id/id_num/first sample.
+    A manifest next to it keeps what `ingest` needs to write the usual output rows.
+    """
+    # A later batch may reuse a custom_id whose request failed in this one
+    batch_id = uuid.uuid4().hex
+    requests, manifest = [], []
+    for job in jobs:
+        template = TEMPLATES[job["template"]]
+        message = model.make_message(job["api"], job["example"], job["template"])
+        custom_ids = []
+        end = job["start_index"] + job["num_samples"]
+        for start in range(job["start_index"], end, model.batch_size):
+            custom_id = make_custom_id(job["task_id"], job["id_num"], start)
+            payload = model.make_payload(message, min(model.batch_size, end - start), template.fmt, job.get("temperature"))
+            requests.append(dict(custom_id=custom_id, method="POST", url=BATCH_URL, body=openai_request.chat_body(**payload)))
+            custom_ids.append(custom_id)
+        entry = dict(
+            batch_id=batch_id,
+            custom_ids=custom_ids,
+            save_path=job.get("save_path", save_path),
+            template=job["template"],
+            api=dict(name=job["api"]["name"]),
+            **{k: job[k] for k in ("task_id", "id_num", "sites", "union_id") if k in job},
+        )
+        manifest.append(entry)
+    write_jsonl(batch_path, requests)
+    write_jsonl(manifest_path(batch_path), manifest)
+    return len(requests)
+
+
+def load_batch_results(results_path: str) -> Iterator[Tuple[str, Optional[List[str]], Optional[str]]]:
+    """(custom_id, completions, error) of each line of a batch result file."""
+    with open(results_path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            response = row.get("response") or {}
+            if row.get("error") or response.get("status_code", 200) != 200:
+                yield row["custom_id"], None, json.dumps(row.get("error") or response.get("body"))
+                continue
+            choices = sorted(response["body"]["choices"], key=lambda choice: choice.get("index", 0))
+            yield row["custom_id"], [choice["message"]["content"] for choice in choices], None
+
+
+def ingest(results_path: str, batch_path: str, fsync: bool = False) -> Counter:
+    """
+    Maps a batch result file back to the rows the online drivers write. Requests that were
+    ingested before are skipped, so a result file can be ingested again or in parts; failed
+    requests are left out, to be written to the next batch file by a --resume run.
+    """
+    jobs = {}
+    with open(manifest_path(batch_path), "r") as f:
+        for order, line in enumerate(f):
+            job = json.loads(line)
+            for custom_id in job["custom_ids"]:
+                jobs[custom_id] = (order, job)
+
+    ingested = {}
+    for order, job in jobs.values():
+        if job["save_path"] not in ingested:
+            try:
+                with open(ingested_path(job["save_path"]), "r") as f:
+                    ingested[job["save_path"]] = set(f.read().split())
+            except FileNotFoundError:
+                ingested[job["save_path"]] = set()
+
+    stats, results = Counter(), []
+    for custom_id, completions, error in load_batch_results(results_path):
+        if custom_id not in jobs:
+            stats["unknown"] += 1
+        elif f"{jobs[custom_id][1]['batch_id']}/{custom_id}" in ingested[jobs[custom_id][1]["save_path"]]:
+            stats["already_ingested"] += 1
+        elif error is not None:
+            stats["failed"] += 1
+            print(f"{custom_id}: {error}")
+        else:
+            results.append((jobs[custom_id][0], parse_custom_id(custom_id)[2], custom_id, completions))
+
+    # Results come back in any order; write them by job and sample like the online drivers
+    new_ids = {}
+    with WriterPool(fsync=fsync) as writers:
+        for _, _, custom_id, completions in sorted(results):
+            job = jobs[custom_id][1]
+            samples = build_samples(job, OpenAIChatDecoder.parse_response(completions, TEMPLATES[job["template"]].fmt))
+            writers.write(job["save_path"], samples)
+            new_ids.setdefault(job["save_path"], []).append(f"{job['batch_id']}/{custom_id}")
+            stats["requests"] += 1
+            stats["rows"] += len(samples)
+    # Only mark the requests as ingested once their rows are on disk
+    for save_path, custom_ids in new_ids.items():
+        with open(ingested_path(save_path), "a") as f:
+            f.write("".join(custom_id + "\n" for custom_id in custom_ids))
+        save_resume_index(save_path, load_resume_index(save_path))
+    return stats
+
+
+def fake_results(batch_path: str, results_path: str, num_tokens: int = 64) -> int:
+    """Answers a batch file locally with the fake backend, in the format of the OpenAI batch API."""
+    rows = []
+    with open(batch_path, "r") as f:
+        for line in f:
+            request = json.loads(line)
+            body = request["body"]
+            prompt = body["messages"][-1]["content"]
+            first = parse_custom_id(request["custom_id"])[2]
+            choices = [
+                dict(
+                    index=k,
+                    message=dict(role="assistant", content=fake_completion(prompt, first + k, num_tokens, is_type_prompt(prompt))),
+                    finish_reason="stop",
+                )
+                for k in range(body.get("n", 1))
+            ]
+            response = dict(status_code=200, body=dict(object="chat.completion", model=body["model"], choices=choices))
+            rows.append(dict(id=f"batch_req_{len(rows)}", custom_id=request["custom_id"], response=response, error=None))
+    write_jsonl(results_path, rows)
+    return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    parser_ingest = subparsers.add_parser("ingest", help="Write the rows of a batch result file to the outputs")
+    parser_ingest.add_argument("results_path", type=str)
+    parser_ingest.add_argument("--batch_file", required=True, type=str, help="The batch file the results answer")
+    parser_ingest.add_argument("--fsync", action="store_true")
+    parser_fake = subparsers.add_parser("fake", help="Answer a batch file locally with the fake backend")
+    parser_fake.add_argument("batch_file", type=str)
+    parser_fake.add_argument("results_path", type=str)
+    parser_fake.add_argument("--num_tokens", default=64, type=int)
+    args = parser.parse_args()
+
+    if args.command == "ingest":
+        stats = ingest(args.results_path, args.batch_file, fsync=args.fsync)
+        print(", ".join(f"{k}: {v}" for k, v in stats.items()) or "Nothing to ingest")
+    else:
+        print(f"Answered {fake_results(args.batch_file, args.results_path, args.num_tokens)} requests in {args.results_path}")
+
+
+if __name__ == "__main__":
+    main()
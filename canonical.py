@@ -0,0 +1,96 @@
+import re
+import json
+import hashlib
+
+# Reprs such as `<object object at 0x7f15b7294b10>` change on every run
+ADDRESS_RE = re.compile(r"<([^<>]*?)\s+at\s+0x[0-9a-fA-F]+>")
+REPR_RE = re.compile(r"^<[^<>]*>$")
+WHITESPACE_RE = re.compile(r"\s+")
+
+# Stable token for bare `object()` sentinels used as "no value given" defaults
+SENTINEL_TOKEN = "<sentinel>"
+
+
+def canonicalize_repr(text):
+    def replace(match):
+        body = match.group(1).strip()
+        if body == "object object":
+            return SENTINEL_TOKEN
+        return f"<{body}>"
+    return ADDRESS_RE.sub(replace, text)
+
+
+def normalize_quotes(text):
+    """Rewrite double-quoted literals as single-quoted ones, as `repr` would."""
+    out = []
+    quote = None
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if quote is None and c == '"':
+            end = text.find('"', i + 1)
+            literal = text[i + 1:end] if end != -1 else None
+            if literal is not None and "'" not in literal and "\\" not in literal:
+                out.append(f"'{literal}'")
+                i = end + 1
+                continue
+        if quote is None and c in "'\"":
+            quote = c
+        elif c == quote and text[i - 1] != "\\":
+            quote = None
+        out.append(c)
+        i += 1
+    return "".join(out)
+
+
+def canonicalize_signature(signature):
+    if not signature:
+        return signature
+    signature = canonicalize_repr(signature)
+    signature = WHITESPACE_RE.sub(" ", signature).strip()
+    signature = signature.replace("( ", "(").replace(" )", ")")
+    return normalize_quotes(signature)
+
+
+def is_sentinel(value):
+    return isinstance(value, str) and REPR_RE.match(value.strip()) is not None
+
+
+def canonicalize_properties(properties):
+    canonical = {}
+    for name, prop in properties.items():
+        prop = canonicalize_schema(prop)
+        # Object reprs are not real defaults and used to leak in as a `str` type
+        if isinstance(prop, dict) and is_sentinel(prop.get("default")):
+            prop.pop("default")
+            if prop.get("type") == "str":
+                prop.pop("type")
+        canonical[name] = prop
+    return canonical
+
+
+def canonicalize_schema(data):
+    """Return a copy of an API info/schema tree that is stable across runs."""
+    if isinstance(data, list):
+        return [canonicalize_schema(item) for item in data]
+    if not isinstance(data, dict):
+        return data
+    canonical = {}
+    for key, value in data.items():
+        if key == "signature" and isinstance(value, str):
+            canonical[key] = canonicalize_signature(value)
+        elif key == "value" and isinstance(value, str):
+            canonical[key] = canonicalize_repr(value)
+        elif key == "properties" and isinstance(value, dict):
+            canonical[key] = canonicalize_properties(value)
+        else:
+            canonical[key] = canonicalize_schema(value)
+    return canonical
+
+
+def canonical_json(obj):
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+def schema_hash(obj):
+    return hashlib.sha256(canonical_json(canonicalize_schema(obj)).encode("utf-8")).hexdigest()
@@ -0,0 +1,111 @@
+import json
+import gzip
+import hashlib
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from canonical import canonical_json
+from example_window import count_tokens
+
+
+def parse_synthesis(synthesis: str) -> Optional[Dict]:
+    """The JSON object of a completion, also for type completions, which continue a prefilled `{"<key>": "`."""
+    text = synthesis.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[-1]
+    text = text.split("```")[0].strip()
+    for candidate in (text, '{"_": "' + text):
+        try:
+            data = json.loads(candidate)
+        except ValueError:
+            continue
+        if isinstance(data, dict):
+            return data
+    return None
+
+
+def normalize_synthesis(synthesis: str) -> Tuple[str, bool]:
+    """
+    (key, valid) of a completion: the canonical JSON of a schema with a name or a return type,
+    else the whitespace-normalized text, so that invalid samples still count as duplicates.
+    """
+    data = parse_synthesis(synthesis)
+    if data is not None and (data.get("name") or "return_type" in data):
+        return canonical_json(data), True
+    return " ".join(synthesis.split()), False
+
+
+class OnlineDedup:
+    """
+    Tracks the distinct samples of each job while they are generated. A job is done once it
+    has `unique_k` distinct valid samples, or once at least `round_size` samples, valid or
+    not, have a duplicate rate of `max_dup_rate` or more.
+    """
+
+    def __init__(self, unique_k: int = None, max_dup_rate: float = None, round_size: int = 2) -> None:
+        self.unique_k = unique_k
+        self.max_dup_rate = max_dup_rate
+        self.round_size = round_size
+        self.seen: Dict[Tuple, set] = defaultdict(set)
+        self.valid: Dict[Tuple, set] = defaultdict(set)
+        self.n_samples = defaultdict(int)
+        self.n_stopped = 0
+        self.n_skipped = 0
+        self.n_observed = 0
+        self.observed_tokens = 0
+
+    @staticmethod
+    def key(job: Dict) -> Tuple:
+        return job.get("template"), job["task_id"], job["id_num"]
+
+    def load(self, filename: str, template: str = None):
+        """Rebuilds the seen samples from an existing output, so that a resumed run stops where it should."""
+        try:
+            with (gzip.open(filename, "rt") if filename.endswith(".gz") else open(filename, "r")) as f:
+                for line in f:
+                    if line.strip():
+                        row = json.loads(line)
+                        self._add((template, row["task_id"], row["id_num"]), row["synthesis"])
+        except FileNotFoundError:
+            pass
+
+    def _add(self, key: Tuple, synthesis: str):
+        normalized, valid = normalize_synthesis(synthesis)
+        digest = hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+        self.n_samples[key] += 1
+        self.seen[key].add(digest)
+        if valid:
+            self.valid[key].add(digest)
+
+    def observe(self, job: Dict, completions: List[str]):
+        for completion in completions:
+            self._add(self.key(job), completion)
+            self.n_observed += 1
+            self.observed_tokens += count_tokens(completion)
+
+    def done(self, job: Dict) -> bool:
+        key = self.key(job)
+        if self.unique_k is not None and len(self.valid[key]) >= self.unique_k:
+            return True
+        n_samples = self.n_samples[key]
+        if self.max_dup_rate is not None and n_samples >= self.round_size:
+            return 1 - len(self.seen[key]) / n_samples >= self.max_dup_rate
+        return False
+
+    def next_round(self, job: Dict, n_drawn: int) -> Dict:
+        """The job restricted to the next round of samples, `n_drawn` of them having been drawn in this run."""
+        return dict(job, num_samples=min(self.round_size, job["num_samples"] - n_drawn), start_index=job["start_index"] + n_drawn)
+
+    def stop(self, n_skipped: int):
+        if n_skipped > 0:
+            self.n_stopped += 1
+            self.n_skipped += n_skipped
+
+    def report(self, completion_tokens: int = None) -> str:
+        """`completion_tokens` generated by the model in this run, if it counts them, gives a better estimate."""
+        tokens = completion_tokens or self.observed_tokens
+        tokens_per_sample = tokens / self.n_observed if self.n_observed else 0
+        return (
+            f"Online dedup: stopped {self.n_stopped} APIs early, skipped {self.n_skipped} samples "
+            f"(~{self.n_skipped * tokens_per_sample:.0f} completion tokens saved)"
+        )
@@ -0,0 +1,108 @@
+import os
+import gzip
+import json
+import argparse
+
+from canonical import schema_hash
+from get_api_schema import split_schema
+from utils import write_jsonl, drop_resume_index
+
+
+def iter_schema_store(path):
+    """Yield (task_id, api_name, schema) from a split JSONL store or a grouped schema JSON store."""
+    if path.endswith(".jsonl"):
+        with open(path, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                schema = json.loads(line)
+                yield schema["task_id"], schema["data"]["name"], schema["data"]
+    else:
+        with open(path, "r") as f:
+            full_api_info = json.load(f)
+        for task_id, task_info in full_api_info.items():
+            for name, api_info in split_schema(task_info).items():
+                if not api_info:
+                    continue
+                yield task_id, api_info.get("name", name), api_info
+
+
+def diff_schema_stores(old_path, new_path):
+    """Return {(task_id, api_name): status} for every added, removed or changed schema."""
+    old_hashes = {(task_id, name): schema_hash(data) for task_id, name, data in iter_schema_store(old_path)}
+    changes = {}
+    n_unchanged = 0
+    for task_id, name, data in iter_schema_store(new_path):
+        key = (task_id, name)
+        old_hash = old_hashes.pop(key, None)
+        if old_hash is None:
+            changes[key] = "added"
+        elif old_hash != schema_hash(data):
+            changes[key] = "changed"
+        else:
+            n_unchanged += 1
+    for key in old_hashes:
+        changes[key] = "removed"
+    return changes, n_unchanged
+
+
+def summarize_by_api(changes):
+    """An API counts as added/removed only if it is so in every task, otherwise as changed."""
+    statuses = {}
+    for (task_id, name), status in changes.items():
+        statuses.setdefault(name, set()).add(status)
+    return {name: status.pop() if len(status) == 1 else "changed" for name, status in statuses.items()}
+
+
+def load_regeneration_list(path):
+    with open(path, "r") as f:
+        return {(item["task_id"], item["api_name"]) for item in map(json.loads, f) if item["status"] != "removed"}
+
+
+def drop_regenerated_rows(save_path, pairs):
+    """Removes the rows of the listed (task_id, api_name) pairs from an output, as they are for the old schemas."""
+    if not os.path.exists(save_path):
+        return 0
+    with (gzip.open(save_path, "rt") if save_path.endswith(".gz") else open(save_path, "r")) as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    kept = [row for row in rows if (row["task_id"], row["api_name"]) not in pairs]
+    if len(kept) < len(rows):
+        dirname, basename = os.path.split(save_path)
+        tmp_path = os.path.join(dirname, f".tmp-{basename}")
+        write_jsonl(tmp_path, kept)
+        # The rows are rewritten rather than appended to, which the resume index could not tell
+        drop_resume_index(save_path)
+        os.replace(tmp_path, save_path)
+    return len(rows) - len(kept)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("old", type=str)
+    parser.add_argument("new", type=str)
+    parser.add_argument("--output", default=None, type=str)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    changes, n_unchanged = diff_schema_stores(args.old, args.new)
+    by_api = summarize_by_api(changes)
+    for status in ("added", "removed", "changed"):
+        n_sites = sum(1 for s in changes.values() if s == status)
+        n_apis = sum(1 for s in by_api.values() if s == status)
+        print(f"{status}: {n_apis} APIs ({n_sites} task/API pairs)")
+        if args.verbose:
+            for name in sorted(name for name, s in by_api.items() if s == status):
+                print(f"  {name}")
+    print(f"unchanged: {n_unchanged} task/API pairs")
+
+    if args.output:
+        # Keep the order of the new store so that regeneration follows the usual id_num order
+        with open(args.output, "w") as f:
+            for (task_id, name), status in changes.items():
+                f.write(json.dumps(dict(task_id=task_id, api_name=name, status=status)) + "\n")
+        n_regen = sum(1 for s in changes.values() if s != "removed")
+        print(f"Wrote {n_regen} (task_id, api) pairs to regenerate to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
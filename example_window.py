@@ -0,0 +1,196 @@
+import re
+import ast
+import json
+import argparse
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from utils import load_api_schema, load_example
+
+# Rough count of BPE tokens in code: identifiers, numbers and single punctuation marks
+TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def count_tokens(text: str) -> int:
+    return len(TOKEN_RE.findall(text))
+
+
+def api_path(api_call: str) -> str:
+    """`ftplib.FTP(host).login(user)` -> `ftplib.FTP.login`"""
+    out, depth = [], 0
+    for ch in api_call:
+        if ch in "([{":
+            depth += 1
+        elif ch in ")]}":
+            depth -= 1
+        elif depth == 0:
+            out.append(ch)
+    return "".join(out)
+
+
+def load_api_uses(path: str = "code2apis.json") -> Dict[str, List[Tuple[int, str, str]]]:
+    """task_id -> [(line, api_key, api_call)] from the "(line, col)" keys of code2apis.json"""
+    with open(path, "r") as f:
+        code2apis = json.load(f)
+    uses = defaultdict(list)
+    for task_id, positions in code2apis.items():
+        for position, apis in positions.items():
+            line = int(position.strip("()").split(",")[0])
+            for api in apis:
+                uses[task_id].append((line, api["api_key"], api["api_call"]))
+    return uses
+
+
+def find_use_lines(code: str, uses: List[Tuple[int, str, str]], name: str) -> List[int]:
+    """Lines where the API is used: exact matches in code2apis, then the last attribute, then plain text search."""
+    lines = sorted({line for line, api_key, api_call in uses if name in (api_key, api_path(api_call))})
+    if lines:
+        return lines
+    attr = api_path(name).split(".")[-1]
+    lines = sorted({
+        line for line, api_key, api_call in uses
+        if attr in (api_key.split(".")[-1], api_path(api_call).split(".")[-1])
+    })
+    if lines:
+        return lines
+    for needle in (name, api_path(name), attr + "("):
+        lines = [i + 1 for i, text in enumerate(code.split("\n")) if needle and needle in text]
+        if lines:
+            return lines
+    return []
+
+
+def _statement_units(tree: ast.Module) -> List[Tuple[int, int, tuple, bool]]:
+    """
+    (first line, last line, enclosing header spans, is compound) of every statement. Compound
+    statements only cover their header lines, so the units are disjoint.
+    """
+    units = []
+
+    def visit(body, headers):
+        for node in body:
+            children = [getattr(node, field) for field in ("body", "orelse", "finalbody", "handlers") if getattr(node, field, None)]
+            if not children:
+                units.append((node.lineno, node.end_lineno, headers, False))
+                continue
+            first_child = min(child[0].lineno for child in children)
+            header = (node.lineno, max(node.lineno, first_child - 1))
+            units.append((*header, headers, True))
+            for child in children:
+                visit(child, headers + (header,))
+
+    visit(tree.body, ())
+    return units
+
+
+def window_example(code: str, target_lines: List[int], budget: int) -> str:
+    """
+    Keeps the imports, the statements using the API and their enclosing headers, then adds
+    the statements closest to the uses while the example stays within `budget` tokens.
+    Elided lines are replaced by `...`.
+    """
+    lines = code.split("\n")
+    if not target_lines or count_tokens(code) <= budget:
+        return code
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return code
+    units = _statement_units(tree)
+    line_tokens = [0] + [count_tokens(line) for line in lines]
+
+    keep, n_tokens = set(), 0
+
+    def add(spans):
+        nonlocal n_tokens
+        for start, end in spans:
+            for line in range(start, end + 1):
+                if line not in keep:
+                    keep.add(line)
+                    n_tokens += line_tokens[line]
+
+    def cost(spans):
+        return sum(line_tokens[line] for start, end in spans for line in range(start, end + 1) if line not in keep)
+
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            add([(node.lineno, node.end_lineno)])
+    for target in target_lines:
+        for start, end, headers, _ in units:
+            if start <= target <= end:
+                add(headers + ((start, end),))
+
+    def distance(unit):
+        return min(abs(unit[0] - target) for target in target_lines)
+
+    # A header alone says little, so headers only come in with the statements below them
+    for start, end, headers, compound in sorted(units, key=distance):
+        spans = headers + ((start, end),)
+        if compound or n_tokens + cost(spans) > budget:
+            continue
+        add(spans)
+
+    windowed, elided, blank = [], None, False
+    for i, line in enumerate(lines, start=1):
+        if i in keep:
+            if elided is not None:
+                windowed.append(elided + "...")
+            elif blank and windowed:
+                windowed.append("")
+            windowed.append(line)
+            elided, blank = None, False
+        elif not line.strip():
+            blank = True
+        elif elided is None:
+            # Elided lines show up as one `...` at the indentation of the first of them
+            elided = line[:len(line) - len(line.lstrip())]
+    if elided is not None:
+        windowed.append(elided + "...")
+    return "\n".join(windowed)
+
+
+class ExampleWindower:
+    """Windows the example of each (task_id, API) and keeps the token counts for a per-run report."""
+
+    def __init__(self, budget: int, path: str = "code2apis.json") -> None:
+        self.budget = budget
+        self.uses = load_api_uses(path)
+        self.n_examples = 0
+        self.full_tokens = 0
+        self.windowed_tokens = 0
+
+    def __call__(self, task_id: str, code: str, name: str) -> str:
+        example = window_example(code, find_use_lines(code, self.uses[task_id], name), self.budget)
+        self.n_examples += 1
+        self.full_tokens += count_tokens(code)
+        self.windowed_tokens += count_tokens(example)
+        return example
+
+    def report(self) -> str:
+        if not self.n_examples:
+            return "Example windowing: no examples"
+        saved = self.full_tokens - self.windowed_tokens
+        return (
+            f"Example windowing (budget {self.budget}): {self.full_tokens / self.n_examples:.0f} -> "
+            f"{self.windowed_tokens / self.n_examples:.0f} estimated example tokens per prompt, "
+            f"{saved / self.n_examples:.0f} saved ({100 * saved / max(1, self.full_tokens):.1f}%)"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget", default=256, type=int)
+    parser.add_argument("--show", default=None, type=int, help="Print the windowed example of this id_num")
+    args = parser.parse_args()
+
+    data = load_example()
+    windower = ExampleWindower(args.budget)
+    for id_num, schema in enumerate(load_api_schema()):
+        example = windower(schema["task_id"], data[schema["task_id"]], schema["data"]["name"])
+        if id_num == args.show:
+            print(example)
+    print(windower.report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import re
+import json
+import random
+import hashlib
+
+NAME_RE = re.compile(r"""['"]name['"]:\s*['"]([^'"]+)['"]""")
+SUFFIXES = ["helper", "op", "fn", "util", "compute", "handler"]
+WORDS = ["returns", "the", "value", "of", "given", "input", "data", "object", "for", "each", "item", "and", "result"]
+TYPES = ["str", "int", "float", "bool", "list", "dict", "None"]
+
+
+def fake_completion(prompt: str, index: int, num_tokens: int = 64, return_type: bool = False) -> str:
+    """
+    A schema-shaped JSON completion that only depends on the prompt and the sample index,
+    so that a resumed run reproduces the samples of an uninterrupted one.
+    """
+    rng = random.Random(hashlib.sha256(f"{index}\0{prompt}".encode("utf-8")).digest())
+    match = NAME_RE.search(prompt)
+    name = match.group(1).split(".")[-1] if match else f"api_{rng.randrange(16 ** 6):06x}"
+    params = [f"arg{i}" for i in range(rng.randint(0, 3))]
+    schema = dict(
+        name=f"{name}_{rng.choice(SUFFIXES)}",
+        type="function",
+        signature="(" + ", ".join(params) + ")",
+        description="",
+        parameters=dict(type="object", properties={param: dict(type=rng.choice(TYPES)) for param in params}),
+    )
+    if return_type:
+        schema["return_type"] = rng.choice(TYPES)
+    # Pad the description so that the completion is about num_tokens words long
+    n_words = max(1, num_tokens - len(json.dumps(schema).split()))
+    schema["description"] = " ".join(rng.choice(WORDS) for _ in range(n_words))
+    return json.dumps(schema, indent=4)
+
+
+def is_type_prompt(prompt: str) -> bool:
+    return "annotate the return type" in prompt
@@ -0,0 +1,133 @@
+import json
+import time
+import random
+import argparse
+import hashlib
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from fake_backend import fake_completion, is_type_prompt
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """
+    Answers POST .../chat/completions like the OpenAI API, with fake_backend completions.
+    Successive calls with the same prompt return new samples.
+    """
+
+    def do_POST(self):
+        server = self.server
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self.send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+
+        n = body.get("n", 1)
+        time.sleep(server.latency + server.token_latency * server.num_tokens)
+        with server.lock:
+            fail = server.rng.random() < server.fail_rate
+            rate_limited = fail and server.rng.random() < 0.5
+            prompt = "\n".join(message["content"] for message in body["messages"])
+            prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+            start_index = server.n_served[prompt_hash]
+            if not fail:
+                server.n_served[prompt_hash] += n
+        if rate_limited:
+            return self.send_json(
+                429, {"error": {"message": "Injected rate limit", "type": "rate_limit_error"}}, {"Retry-After": "1"}
+            )
+        if fail:
+            return self.send_json(500, {"error": {"message": "Injected server error", "type": "server_error"}})
+
+        return_type = is_type_prompt(prompt)
+        choices = [
+            dict(
+                index=k,
+                message=dict(role="assistant", content=fake_completion(prompt, start_index + k, server.num_tokens, return_type)),
+                finish_reason="stop",
+            )
+            for k in range(n)
+        ]
+        n_prompt_tokens = len(prompt.split())
+        self.send_json(
+            200,
+            dict(
+                id=f"chatcmpl-{prompt_hash[:24]}-{start_index}",
+                object="chat.completion",
+                created=int(time.time()),
+                model=body.get("model", "fake"),
+                choices=choices,
+                usage=dict(
+                    prompt_tokens=n_prompt_tokens,
+                    completion_tokens=server.num_tokens * n,
+                    total_tokens=n_prompt_tokens + server.num_tokens * n,
+                ),
+            ),
+        )
+
+    def send_json(self, status: int, payload: dict, headers: dict = None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def make_server(
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    latency: float = 0.0,
+    token_latency: float = 0.0,
+    num_tokens: int = 64,
+    fail_rate: float = 0.0,
+    seed: int = 0,
+    verbose: bool = False,
+) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.token_latency = token_latency
+    server.num_tokens = num_tokens
+    server.fail_rate = fail_rate
+    server.rng = random.Random(seed)
+    server.lock = threading.Lock()
+    server.n_served = Counter()
+    server.verbose = verbose
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local OpenAI-compatible server for load tests, e.g. "
+        "OPENAI_API_KEY=fake python synthesize_fc.py --backend openai --base_url http://127.0.0.1:8000/v1"
+    )
+    parser.add_argument("--host", default="127.0.0.1", type=str)
+    parser.add_argument("--port", default=8000, type=int)
+    parser.add_argument("--latency", default=0.0, type=float, help="Seconds per request")
+    parser.add_argument("--token_latency", default=0.0, type=float, help="Seconds per completion token")
+    parser.add_argument("--num_tokens", default=64, type=int, help="Completion length in words")
+    parser.add_argument("--fail_rate", default=0.0, type=float, help="Fraction of requests answered with a 429 or 500")
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    server = make_server(
+        args.host, args.port, args.latency, args.token_latency, args.num_tokens, args.fail_rate, args.seed, args.verbose
+    )
+    print(f"Serving fake OpenAI API at http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == "__main__":
+    main()
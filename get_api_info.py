@@ -4,6 +4,8 @@ import importlib
 import json
 from tqdm import tqdm
 
+from canonical import canonicalize_signature, canonicalize_repr
+
 
 def filter_unused_args(signature, api_call):
     # Extract arguments from the signature
@@ -67,7 +69,7 @@ def get_subscript_method_info(base_api, subscript, method):
         result = {
             'name': f"{base_api}[{subscript}].{method}",
             'type': 'method',
-            'signature': str(inspect.signature(method_obj)),
+            'signature': canonicalize_signature(str(inspect.signature(method_obj))),
             # 'description': inspect.getdoc(method_obj) or ''
         }
         
@@ -142,24 +144,24 @@ def get_api_info(api_call):
         elif inspect.isclass(module):
             result['type'] = 'class'
             try:
-                result['signature'] = str(inspect.signature(module))
+                result['signature'] = canonicalize_signature(str(inspect.signature(module)))
             except ValueError:
                 try:
-                    result['signature'] = str(inspect.signature(module.__init__))
+                    result['signature'] = canonicalize_signature(str(inspect.signature(module.__init__)))
                 except ValueError:
                     pass
         elif callable(module):
             result['type'] = 'callable'
             try:
-                result['signature'] = str(inspect.signature(module))
+                result['signature'] = canonicalize_signature(str(inspect.signature(module)))
             except ValueError:
                 try:
-                    result['signature'] = str(inspect.signature(module.__call__))
+                    result['signature'] = canonicalize_signature(str(inspect.signature(module.__call__)))
                 except ValueError:
                     pass
         else:
             result['type'] = 'constant'
-            result['value'] = str(module)
+            result['value'] = canonicalize_repr(str(module))
         if result['signature'] and "(" in api_call:
             result['signature'] = filter_unused_args(result['signature'], api_call)
         # result['description'] = inspect.getdoc(module) or ''
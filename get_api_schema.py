@@ -1,5 +1,15 @@
+import os
 import re
 import json
+import hashlib
+import argparse
+
+from canonical import canonicalize_schema, canonical_json, is_sentinel
+from schema_types import Parameter
+
+# Bump whenever the schema logic changes so that cached tasks are regenerated
+MANIFEST_VERSION = 2
+
 
 def parse_api_info(api_info):
     if api_info['type'] == 'constant':
@@ -47,7 +57,7 @@ def parse_signature(signature):
         if ':' in name_and_type:
             name, type_annotation = name_and_type.split(':', 1)
             name = name.strip()
-            type_annotation = type_annotation.strip().strip("'")
+            type_annotation = type_annotation.strip().strip("'\"")
         else:
             name = name_and_type
             type_annotation = None
@@ -65,12 +75,13 @@ def parse_signature(signature):
             
             # There's a type annotation or default value
             if '=' in param:
-                # There's a default value
+                # There's a default value, unless it is an object repr such as <sentinel>
                 default = parts[-1].strip()
-                param_info["default"] = parse_default_value(default)
+                if not is_sentinel(default):
+                    param_info["default"] = parse_default_value(default)
             else:
                 # There's only a type annotation
-                type_annotation = parts[1].strip().strip("'")
+                type_annotation = parts[1].strip().strip("'\"")
                 
                 param_info["type"] = parse_type_annotation(type_annotation)
         
@@ -91,20 +102,21 @@ def parse_signature(signature):
         #     if "type" not in param_info or param_info["type"] == ["object"]:
         #         param_info["type"] = [type(parsed_default).__name__]
         
-        parameters[name] = param_info
+        parameters[name] = Parameter.from_info(name, param_info)
     return parameters
 
 def parse_type_annotation(annotation):
     if '|' in annotation:
         types = [t.strip().lower() for t in annotation.split('|')]
-        parsed_types = set()
+        # Keep the annotation order so that the output is deterministic
+        parsed_types = dict()
         for t in types:
             if t == 'none':
-                parsed_types.add('null')
+                parsed_types['null'] = None
             elif t.startswith('os.pathlike'):
-                parsed_types.add('string')
+                parsed_types['string'] = None
             else:
-                parsed_types.add(t)
+                parsed_types[t] = None
         return list(parsed_types)
     elif annotation.lower().startswith('os.pathlike'):
         return ['string']
@@ -131,37 +143,9 @@ def create_parameter_schema(parsed_signature):
         "properties": {}
     }
     
-    for param_name, param_info in parsed_signature.items():
-        param_schema = {}
-        if "type" in param_info:
-            types = param_info["type"]
-            if isinstance(types, list):
-                cleaned_types = []
-                for t in types:
-                    if t == "none":
-                        cleaned_types.append("null")
-                    elif t in ["true", "false"]:
-                        cleaned_types.append("boolean")
-                    elif t == "int":
-                        cleaned_types.append("integer")
-                    else:
-                        cleaned_types.append(t)
-                param_schema["type"] = cleaned_types if len(cleaned_types) > 1 else cleaned_types[0]
-            else:
-                if types == "none":
-                    param_schema["type"] = "null"
-                elif types in ["true", "false"]:
-                    param_schema["type"] = "boolean"
-                elif types == "int":
-                    param_schema["type"] = "integer"
-                else:
-                    param_schema["type"] = types
-        
-        if "default" in param_info:
-            param_schema["default"] = param_info["default"]
-        
+    for param_name, param in parsed_signature.items():
         # if param_schema:  # Only add non-empty parameter schemas
-        schema["properties"][param_name] = param_schema
+        schema["properties"][param_name] = param.to_schema()
     return schema
 
 def process_api_info(api_info):
@@ -205,28 +189,102 @@ def split_schema(api_info, parent_name=''):
             split_schemas.update(nested_schemas)
     
     return split_schemas
-    
-    
-    
-if __name__ == "__main__":
-     # Read the JSON file
-    with open('apis_info_grouped.json', 'r') as f:
+
+
+def task_hash(task_info):
+    return hashlib.sha256(canonical_json(task_info).encode("utf-8")).hexdigest()
+
+
+def split_task_lines(task_id, task_info):
+    lines = []
+    tmp_schemas = split_schema(task_info)
+    for name, api_info in tmp_schemas.items():
+        if not api_info:
+            continue
+        api = dict()
+        api["task_id"] = task_id
+        api["data"] = api_info
+        lines.append(json.dumps(api) + "\n")
+    return lines
+
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+    # A manifest written by an older version of the schema logic is stale as a whole
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {}
+    return manifest["tasks"]
+
+
+def load_split_lines(split_path):
+    task_lines = {}
+    with open(split_path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            task_id = json.loads(line)["task_id"]
+            task_lines.setdefault(task_id, []).append(line if line.endswith("\n") else line + "\n")
+    return task_lines
+
+
+def atomic_write(path, write_fn):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        write_fn(f)
+    os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", default="apis_info_grouped.json", type=str)
+    parser.add_argument("--schema_path", default="apis_info_grouped_schema.json", type=str)
+    parser.add_argument("--split_path", default="apis_info_grouped_schema_split.jsonl", type=str)
+    parser.add_argument("--manifest_path", default="apis_info_grouped_schema.manifest.json", type=str)
+    parser.add_argument("--force", action="store_true")
+    args = parser.parse_args()
+
+    # Read the JSON file
+    with open(args.input, "r") as f:
         full_api_info = json.load(f)
-    
+    # Strip memory addresses and normalize signatures so identical APIs hash identically
+    full_api_info = {task_id: canonicalize_schema(task_info) for task_id, task_info in full_api_info.items()}
+
+    # Hash the grouped info before processing, which mutates it in place
+    hashes = {task_id: task_hash(task_info) for task_id, task_info in full_api_info.items()}
+
+    manifest = {}
+    old_api_info, old_split_lines = {}, {}
+    if not args.force and os.path.exists(args.schema_path) and os.path.exists(args.split_path):
+        manifest = load_manifest(args.manifest_path)
+        if manifest:
+            with open(args.schema_path, "r") as f:
+                old_api_info = json.load(f)
+            old_split_lines = load_split_lines(args.split_path)
+
+    new_api_info, new_split_lines = {}, {}
+    changed = []
     for task_id, task_info in full_api_info.items():
+        if manifest.get(task_id) == hashes[task_id] and task_id in old_api_info:
+            new_api_info[task_id] = old_api_info[task_id]
+            new_split_lines[task_id] = old_split_lines.get(task_id, [])
+            continue
         process_api_info(task_info)
-    
-    with open('apis_info_grouped_schema.json', 'w') as f:
-        json.dump(full_api_info, f, indent=2)
-        
-    with open('apis_info_grouped_schema_split.jsonl', 'w') as f:
-        new_api_info = []
-        for task_id, task_info in full_api_info.items():
-            tmp_schemas = split_schema(task_info)
-            for name, api_info in tmp_schemas.items():
-                if not api_info:
-                    continue
-                api = dict()
-                api["task_id"] = task_id
-                api["data"] = api_info
-                f.write(json.dumps(api) + "\n")
+        new_api_info[task_id] = task_info
+        new_split_lines[task_id] = split_task_lines(task_id, task_info)
+        changed.append(task_id)
+
+    removed = [task_id for task_id in manifest if task_id not in full_api_info]
+    print(f"Regenerated {len(changed)}/{len(full_api_info)} tasks, removed {len(removed)}")
+    if not changed and not removed and list(old_api_info) == list(new_api_info):
+        return
+
+    atomic_write(args.schema_path, lambda f: json.dump(new_api_info, f, indent=2))
+    atomic_write(args.split_path, lambda f: f.writelines(line for lines in new_split_lines.values() for line in lines))
+    atomic_write(args.manifest_path, lambda f: json.dump({"version": MANIFEST_VERSION, "tasks": hashes}, f, indent=2))
+
+
+if __name__ == "__main__":
+    main()
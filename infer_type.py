@@ -1,8 +1,7 @@
 import os
-import json
 import argparse
 
-from model_type import DecoderBase, make_model
+from model import DecoderBase, make_model
 from rich.progress import (
     BarColumn,
     MofNCompleteColumn,
@@ -10,7 +9,19 @@ from rich.progress import (
     TextColumn,
     TimeElapsedColumn,
 )
-from utils import write_jsonl, load_api_schema, load_example
+from utils import load_api_schema, load_example, load_resume_index, save_resume_index
+from merge_schema import load_union_schema
+from diff_schema import load_regeneration_list, drop_regenerated_rows
+from pipeline import build_samples, run_batched
+from response_cache import ResponseCache
+from prompt_store import PromptStore
+from shards import shard_of, shard_save_path
+from writer import WriterPool
+from example_window import ExampleWindower
+from telemetry import Telemetry
+from dedup import OnlineDedup
+from batch_file import write_batch_requests
+from work_queue import run_queue
 
 def codegen(
     model: DecoderBase,
@@ -19,6 +30,20 @@ def codegen(
     n_samples=1,
     id_range=None,
     resume=True,
+    union_path=None,
+    only=None,
+    pipeline=False,
+    chunk_size=1024,
+    num_shards=1,
+    shard_id=0,
+    fsync=False,
+    example_budget=None,
+    unique_k=None,
+    max_dup_rate=None,
+    dedup_round=2,
+    schedule=False,
+    batch_file=None,
+    queue=None,
 ):
     with Progress(
         TextColumn(f"Synthesize Type Annotation •" + "[progress.percentage]{task.percentage:>3.0f}%"),
@@ -26,16 +51,31 @@ def codegen(
         MofNCompleteColumn(),
         TextColumn("•"),
         TimeElapsedColumn(),
-    ) as p:
+    ) as p, WriterPool(fsync=fsync) as writers:
         
         # create save_path if it doesn't exist, e.g., a/b.jsonl
         dirname = os.path.dirname(save_path)
         if not os.path.exists(dirname) and dirname != "":
             os.makedirs(dirname)
         
-        api_schemas = load_api_schema()
+        # A union store queries each API once and fans the samples out to all of its call sites
+        api_schemas = load_api_schema() if union_path is None else load_union_schema(union_path)
         data = load_example()
+        # Only the code around the uses of each API goes into its prompt
+        windower = ExampleWindower(example_budget) if example_budget else None
+        # The samples of the pairs listed by --only are for their old schemas
+        if only is not None:
+            p.console.print(f"Dropped {drop_regenerated_rows(save_path, only)} samples to regenerate from {save_path}")
+        # Count the existing samples once instead of re-reading save_path for every schema
+        existing = load_resume_index(save_path) if resume else None
+        template = "type"
+        # Stop sampling an API early once its samples stop being new
+        dedup = OnlineDedup(unique_k, max_dup_rate, dedup_round) if unique_k or max_dup_rate else None
+        if dedup is not None and resume:
+            dedup.load(save_path, template)
+        jobs = []
         for id_num, schema in enumerate(p.track(api_schemas)):
+            id_num = schema.get("id_num", id_num)
             task_id = schema["task_id"]
             api = schema["data"]
             api_type = api.pop("type", None)
@@ -46,51 +86,84 @@ def codegen(
                 if id_num < low or id_num >= high:
                     p.console.print(f"Skipping {id_num} as it is not in {id_range}")
                     continue
+            if num_shards > 1 and shard_of(task_id, api["name"], num_shards) != shard_id:
+                continue
+            sites = schema.get("sites", [dict(id_num=id_num, task_id=task_id)])
+            if only is not None and not any((site["task_id"], api["name"]) in only for site in sites):
+                continue
 
-            # read the existing file if save_path exists
-            if os.path.exists(save_path):
-                with open(save_path, "r") as f:
-                    existing_data = f.read().splitlines()
-            
             log = f"Synthesis: {id_num} @ {model}"
             example = data[task_id]
+            if windower is not None:
+                example = windower(task_id, example, api["name"])
             n_existing = 0
 
             if resume:
-                if os.path.exists(save_path):
-                    n_existing = len([1 for line in existing_data if json.loads(line)["id_num"] == id_num and
-                                    json.loads(line)["task_id"] == task_id])
-                else:
-                    n_existing = 0
+                n_existing = existing[(task_id, id_num)]
                 if n_existing > 0:
                     log += f" (resuming from {n_existing})"
 
             nsamples = n_samples - n_existing
+            job = dict(id_num=id_num, task_id=task_id, api=api, example=example, sites=sites, num_samples=nsamples, start_index=n_existing, template=template)
+            if "union_id" in schema:
+                job["union_id"] = schema["union_id"]
+            if pipeline or batch_file or queue:
+                # Defer generation so that prompts of many schemas are batched together
+                if nsamples > 0:
+                    jobs.append(job)
+                continue
             p.console.print(log)
 
             sidx = n_samples - nsamples
             while sidx < n_samples:
+                if dedup is not None and dedup.done(job):
+                    dedup.stop(n_samples - sidx)
+                    break
                 outputs = model.codegen(
                     api,
                     example,
+                    template=template,
                     do_sample=not greedy,
-                    num_samples=n_samples - sidx,
+                    num_samples=n_samples - sidx if dedup is None else min(dedup_round, n_samples - sidx),
+                    start_index=sidx,
                 )
-                assert outputs, "No outputs from model!"
-
-                samples = [
-                    dict(
-                        id_num=id_num,
-                        task_id=task_id,
-                        api_name=api["name"],
-                        synthesis=completion,
-                    )
-                    for id_num, completion in zip([id_num]*len(outputs), outputs)
-                ]
+                if not outputs:
+                    # Its requests failed for good; a --resume run samples the rest again
+                    print(f"No outputs from model for {job['task_id']} ({job['id_num']}), skipping")
+                    break
+
+                samples = build_samples(job, outputs)
                 print(f"Generated {len(samples)} samples")
-                write_jsonl(save_path, samples, append=True)
+                writers.write(save_path, samples)
+                if resume:
+                    for sample in samples:
+                        existing[(sample["task_id"], sample["id_num"])] += 1
+                if dedup is not None:
+                    dedup.observe(job, outputs)
                 sidx += len(outputs)
 
+        if queue is not None:
+            # Any worker may generate any job of the queue, so each job carries everything it needs
+            lease_size = max(1, chunk_size // max(1, n_samples))
+            run_queue(p, model, jobs, queue, save_path, do_sample=not greedy, lease_size=lease_size)
+        elif jobs and batch_file:
+            n_requests = write_batch_requests(model, jobs, save_path, batch_file)
+            p.console.print(f"Wrote {n_requests} requests for {len(jobs)} schemas to {batch_file}")
+        elif jobs:
+            run_batched(p, model, jobs, save_path, existing, do_sample=not greedy, chunk_size=chunk_size, writers=writers, dedup=dedup, schedule=schedule)
+
+        # The resume index records the file size, so the samples must be on disk first
+        writers.close()
+        if resume and queue is None:
+            save_resume_index(save_path, existing)
+
+        if windower is not None:
+            p.console.print(windower.report())
+        if dedup is not None:
+            p.console.print(dedup.report(model.stats.get("completion_tokens")))
+        if model.summary():
+            p.console.print(f"Run summary @ {model}: {model.summary()}")
+
 
 def main():
     parser = argparse.ArgumentParser()
@@ -102,12 +175,34 @@ def main():
     parser.add_argument("--greedy", action="store_true")
     parser.add_argument("--resume", action="store_true")
     parser.add_argument("--id_range", nargs=2, type=int)
-    parser.add_argument("--backend", default="vllm", type=str, choices=["vllm", "openai"])
-    parser.add_argument("--base_url", default=None, type=str)
+    parser.add_argument("--num_shards", default=1, type=int)
+    parser.add_argument("--shard_id", default=0, type=int)
+    parser.add_argument("--union_path", default=None, type=str)
+    parser.add_argument("--only", default=None, type=str, help="Regeneration list written by diff_schema.py; the existing samples of its pairs are dropped first")
+    parser.add_argument("--pipeline", action="store_true", help="Batch the prompts of many schemas per generate call")
+    parser.add_argument("--chunk_size", default=1024, type=int, help="Sequences per batched generate call")
+    parser.add_argument("--backend", default="vllm", type=str, choices=["vllm", "openai", "fake"])
+    parser.add_argument("--base_url", default=None, type=str, nargs="+", help="One or more OpenAI-compatible endpoints to balance across")
+    parser.add_argument("--concurrency", default=1, type=int, help="In-flight requests for --backend openai")
+    parser.add_argument("--max_concurrency", default=None, type=int, help="Adapt the in-flight requests between 1 and this, starting at --concurrency")
     parser.add_argument("--tp", default=1, type=int)
     parser.add_argument("--trust_remote_code", action="store_true")
     parser.add_argument("--tokenizer_legacy", action="store_true")
     parser.add_argument("--tokenizer_name", default=None, type=str)
+    parser.add_argument("--enable_prefix_caching", action="store_true")
+    parser.add_argument("--cache_dir", default=None, type=str, help="Reuse completions cached on disk, e.g. ~/.cache/big-fc")
+    parser.add_argument("--cache_max_gb", default=10, type=float)
+    parser.add_argument("--example_budget", default=None, type=int, help="Window each example to about this many tokens")
+    parser.add_argument("--unique_k", default=None, type=int, help="Stop sampling an API once it has this many distinct valid samples")
+    parser.add_argument("--max_dup_rate", default=None, type=float, help="Stop sampling an API once this fraction of its valid samples are duplicates")
+    parser.add_argument("--dedup_round", default=2, type=int, help="Samples drawn per API between two dedup checks")
+    parser.add_argument("--schedule", action="store_true", help="Submit prompts grouped by example and sorted by length; the output keeps id_num order")
+    parser.add_argument("--batch_file", default=None, type=str, help="Write the pending requests to this OpenAI batch file instead of sending them")
+    parser.add_argument("--queue", default=None, type=str, help="SQLite work queue shared with other workers; the rows go to save_path once it is drained")
+    parser.add_argument("--fsync", action="store_true", help="fsync the output after every flush")
+    parser.add_argument("--metrics_path", default=None, type=str, help="Per-request latency and token metrics (JSONL)")
+    parser.add_argument("--prom_path", default=None, type=str, help="Prometheus textfile with the aggregated metrics")
+    parser.add_argument("--prompt_store", default=None, type=str, help="Reuse rendered and tokenized prompts (vllm only), e.g. prompts.npz")
 
     args = parser.parse_args()
 
@@ -118,11 +213,26 @@ def main():
         args.greedy = True
         print("Greedy decoding ON (--greedy): setting bs=1, n_samples=1, temperature=0")
 
+    if args.backend == "openai" and (args.concurrency > 1 or args.max_concurrency):
+        # The async decoder only pays off when requests of many schemas are in flight
+        args.pipeline = True
+
+    if args.batch_file:
+        assert args.backend == "openai", "--batch_file needs --backend openai to render the requests"
+
+    if args.queue:
+        # Queue workers generate whole jobs in leased batches, without dedup rounds or scheduling
+        assert not (args.unique_k or args.max_dup_rate or args.schedule or args.batch_file), (
+            "--queue cannot be combined with --unique_k, --max_dup_rate, --schedule or --batch_file"
+        )
+
     if args.id_range is not None:
         assert len(args.id_range) == 2, "id_range must be a list of length 2"
         assert args.id_range[0] < args.id_range[1], "id_range must be increasing"
         args.id_range = tuple(args.id_range)
 
+    assert 0 <= args.shard_id < args.num_shards, "shard_id must be in [0, num_shards)"
+
     # Make dir for codes generated by each model
     model_runner = make_model(
         model=args.model,
@@ -133,14 +243,25 @@ def main():
         tp=args.tp,
         trust_remote_code=args.trust_remote_code,
         tokenizer_name=args.tokenizer_name,
-        tokenizer_legacy=args.tokenizer_legacy
+        tokenizer_legacy=args.tokenizer_legacy,
+        enable_prefix_caching=args.enable_prefix_caching,
+        concurrency=args.concurrency,
+        max_concurrency=args.max_concurrency,
     )
+    if args.cache_dir:
+        model_runner.cache = ResponseCache(args.cache_dir, max_bytes=int(args.cache_max_gb * 1024 ** 3))
+    if args.prompt_store:
+        model_runner.prompt_store = PromptStore(args.prompt_store)
+    if args.metrics_path or args.prom_path:
+        model_runner.telemetry = Telemetry(args.metrics_path, args.prom_path)
     
     if not args.save_path:
         save_path = args.model.replace("/", "--") + f"--{args.backend}-{args.temperature}-{args.n_samples}.jsonl"
         save_path = "typeinfer--" + save_path
     else:
         save_path = args.save_path
+    if args.num_shards > 1:
+        save_path = shard_save_path(save_path, args.shard_id, args.num_shards)
 
     codegen(
         model=model_runner,
@@ -148,7 +269,21 @@ def main():
         greedy=args.greedy,
         n_samples=args.n_samples,
         resume=args.resume,
-        id_range=args.id_range
+        id_range=args.id_range,
+        union_path=args.union_path,
+        only=load_regeneration_list(args.only) if args.only else None,
+        pipeline=args.pipeline,
+        chunk_size=args.chunk_size,
+        num_shards=args.num_shards,
+        shard_id=args.shard_id,
+        fsync=args.fsync,
+        example_budget=args.example_budget,
+        unique_k=args.unique_k,
+        max_dup_rate=args.max_dup_rate,
+        dedup_round=args.dedup_round,
+        schedule=args.schedule,
+        batch_file=args.batch_file,
+        queue=args.queue,
     )
 
 
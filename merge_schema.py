@@ -0,0 +1,168 @@
+import json
+import argparse
+
+from canonical import canonicalize_schema, canonical_json
+
+
+def split_args(signature):
+    """Split `(a, b: 'Tuple[int, int]' = (1, 2)) -> int` into its top-level arguments and return suffix."""
+    args, depth, quote, current = [], 0, None, ""
+    body, end = signature[1:], len(signature)
+    for i, c in enumerate(body):
+        if quote:
+            if c == quote and body[i - 1] != "\\":
+                quote = None
+        elif c in "'\"":
+            quote = c
+        elif c in "([{":
+            depth += 1
+        elif c in ")]}":
+            if depth == 0:
+                end = i
+                break
+            depth -= 1
+        elif c == "," and depth == 0:
+            args.append(current.strip())
+            current = ""
+            continue
+        current += c
+    if current.strip():
+        args.append(current.strip())
+    return args, body[end + 1:]
+
+
+def merge_order(union, items):
+    """Insert the unseen items into union, keeping the relative order of items."""
+    position = 0
+    for item in items:
+        if item in union:
+            position = union.index(item) + 1
+        else:
+            union.insert(position, item)
+            position += 1
+    return union
+
+
+def reconstruct(union, site):
+    """Rebuild the per-site schema from its union schema and argument masks."""
+    if "data" in site:
+        return site["data"]
+    data = {}
+    for key, value in union.items():
+        if key == "union_id":
+            continue
+        if key == "signature" and "args" in site:
+            args = [union["arguments"][i] for i in site["args"]]
+            data[key] = f"({', '.join(args)})" + union["signature_suffix"]
+        elif key == "parameters" and "params" in site:
+            names = [union["parameter_names"][i] for i in site["params"]]
+            data[key] = dict(value, properties={name: value["properties"][name] for name in names})
+        elif key not in ("arguments", "signature_suffix", "parameter_names"):
+            data[key] = value
+    return data
+
+
+def build_union(schemas):
+    """Group the split schemas by API name into one union schema per API plus per-site masks."""
+    groups = {}
+    for id_num, schema in enumerate(schemas):
+        data = canonicalize_schema(schema["data"])
+        groups.setdefault(data["name"], []).append((id_num, schema["task_id"], data))
+
+    unions, sites = [], []
+    for name, members in groups.items():
+        base = dict(max(members, key=lambda member: len(member[2]))[2])
+        union_args, suffix, union_props = [], None, {}
+        for _, _, data in members:
+            if data.get("signature"):
+                args, data_suffix = split_args(data["signature"])
+                merge_order(union_args, args)
+                suffix = data_suffix if suffix is None else suffix
+            for prop_name, prop in data.get("parameters", {}).get("properties", {}).items():
+                union_props.setdefault(prop_name, prop)
+        prop_order = []
+        for _, _, data in members:
+            merge_order(prop_order, list(data.get("parameters", {}).get("properties", {})))
+
+        union = {"union_id": len(unions)}
+        for key, value in base.items():
+            if key == "signature" and value:
+                union[key] = f"({', '.join(union_args)})" + suffix
+                union["arguments"] = union_args
+                union["signature_suffix"] = suffix
+            elif key == "parameters" and isinstance(value, dict) and "properties" in value:
+                union[key] = dict(value, properties={p: union_props[p] for p in prop_order})
+                union["parameter_names"] = prop_order
+            else:
+                union[key] = value
+
+        for id_num, task_id, data in members:
+            site = {"id_num": id_num, "task_id": task_id, "union_id": union["union_id"]}
+            if "arguments" in union and data.get("signature"):
+                args, _ = split_args(data["signature"])
+                site["args"] = [union_args.index(arg) for arg in args]
+            if "parameter_names" in union and "parameters" in data:
+                site["params"] = [prop_order.index(p) for p in data["parameters"].get("properties", {})]
+            # Sites that cannot be rebuilt exactly keep their own schema
+            rebuilt = reconstruct(union, site)
+            if canonical_json(rebuilt) != canonical_json(data) or list(rebuilt) != list(data):
+                site = {"id_num": id_num, "task_id": task_id, "union_id": union["union_id"], "data": data}
+            sites.append(site)
+        unions.append(union)
+    sites.sort(key=lambda site: site["id_num"])
+    return unions, sites
+
+
+def public_schema(union):
+    """Strip the bookkeeping fields that should not be shown to the LLM."""
+    return {k: v for k, v in union.items() if k not in ("union_id", "arguments", "signature_suffix", "parameter_names")}
+
+
+def load_union_schema(path="apis_union_schema.json"):
+    """Load the union store as driver-ready schemas, one per API, each listing the sites it covers."""
+    with open(path, "r") as f:
+        store = json.load(f)
+    sites = {}
+    for site in store["sites"]:
+        sites.setdefault(site["union_id"], []).append(site)
+    schemas = []
+    for union in store["unions"]:
+        members = sites.get(union["union_id"], [])
+        if not members:
+            continue
+        schemas.append(
+            dict(
+                id_num=members[0]["id_num"],
+                task_id=members[0]["task_id"],
+                union_id=union["union_id"],
+                data=public_schema(union),
+                sites=[dict(id_num=site["id_num"], task_id=site["task_id"]) for site in members],
+            )
+        )
+    return schemas
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", default="apis_info_grouped_schema_split.jsonl", type=str)
+    parser.add_argument("--output", default="apis_union_schema.json", type=str)
+    args = parser.parse_args()
+
+    with open(args.input, "r") as f:
+        schemas = [json.loads(line) for line in f if line.strip()]
+
+    unions, sites = build_union(schemas)
+    for site in sites:
+        union = unions[site["union_id"]]
+        assert canonical_json(reconstruct(union, site)) == canonical_json(canonicalize_schema(schemas[site["id_num"]]["data"]))
+
+    with open(args.output, "w") as f:
+        json.dump({"unions": unions, "sites": sites}, f, indent=2)
+
+    n_distinct = len({canonical_json(canonicalize_schema(schema["data"])) for schema in schemas})
+    n_override = sum(1 for site in sites if "data" in site)
+    print(f"{len(sites)} call sites, {n_distinct} distinct schemas -> {len(unions)} union schemas ({n_override} sites kept verbatim)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,25 @@
 import json
 import os
+import time
+import random
+import hashlib
 from abc import ABC, abstractmethod
-from typing import List
+from collections import Counter
+from typing import Iterator, List, Optional, Tuple
 from warnings import warn
 
 import openai
 import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer
-from constants import POSITIVE_TEMPLATE, NEGATIVE_TEMPLATE, SCHEMA, RESPONSE_TEMPLATE
+from constants import (
+    POSITIVE_TEMPLATE,
+    NEGATIVE_TEMPLATE,
+    SCHEMA,
+    RESPONSE_TEMPLATE,
+    TYPE_INFERENCE_TEMPLATE,
+    TYPE_SCHEMA,
+    TYPE_RESPONSE_TEMPLATE,
+)
 
 try:
     from vllm import LLM, SamplingParams
@@ -15,6 +27,8 @@ except ImportError:
     warn("VLLM decoder will not work. Fix by `pip install vllm`")
 
 import openai_request
+from canonical import canonical_json
+from fake_backend import fake_completion
 
 EOS = [
     "<|endoftext|>",
@@ -27,24 +41,47 @@ EOS = [
 _MAGIC_SPLITTER_ = "-[[]]-this-is-really-our-highest-priority-[[]]-"
 
 
-def make_chat_prompt(api: str, example: str, tokenizer: AutoTokenizer, negative: bool = False) -> str:
-    if negative:
-        prompt = NEGATIVE_TEMPLATE.format(api=api, example=example)
-        response = SCHEMA + RESPONSE_TEMPLATE.format(_MAGIC_SPLITTER_=_MAGIC_SPLITTER_, label="irrelevant")
-    else:
-        prompt = POSITIVE_TEMPLATE.format(api=api, example=example)
-        if "error" in api:
-            response = SCHEMA + RESPONSE_TEMPLATE.format(_MAGIC_SPLITTER_=_MAGIC_SPLITTER_, label="relevant")
-        else:
-            response = SCHEMA + RESPONSE_TEMPLATE.format(_MAGIC_SPLITTER_=_MAGIC_SPLITTER_, label="relevant")
-    prompt = tokenizer.apply_chat_template(
-        [
-            {"role": "user", "content": prompt},
-            {"role": "assistant", "content": response},
-        ],
-        tokenize=False,
-    ).split(_MAGIC_SPLITTER_)[0]
-    return prompt
+class TaskTemplate:
+    """Prompt layout of one job type: the instruction, the expected schema and the response scaffold."""
+
+    def __init__(self, name: str, instruction: str, schema: str, response: str, fmt: str = "json_object") -> None:
+        self.name = name
+        self.instruction = instruction
+        self.schema = schema
+        self.response = response
+        # response_format of the OpenAI backend
+        self.fmt = fmt
+
+    def chat_response(self) -> str:
+        return self.schema + self.response.format(_MAGIC_SPLITTER_=_MAGIC_SPLITTER_)
+
+    def chat_prompt(self, api: str, example: str, tokenizer: AutoTokenizer) -> str:
+        return tokenizer.apply_chat_template(
+            [
+                {"role": "user", "content": self.instruction.format(api=api, example=example)},
+                {"role": "assistant", "content": self.chat_response()},
+            ],
+            tokenize=False,
+        ).split(_MAGIC_SPLITTER_)[0]
+
+    def message(self, api: str, example: str) -> str:
+        return self.instruction.format(api=api, example=example) + "\n" + self.schema + self.response.split("```json")[0]
+
+
+class TypeInferenceTemplate(TaskTemplate):
+    def message(self, api: str, example: str) -> str:
+        return self.instruction.format(api=api, example=example) + "\n" + self.chat_response()
+
+
+TEMPLATES = {
+    "positive": TaskTemplate("positive", POSITIVE_TEMPLATE, SCHEMA, RESPONSE_TEMPLATE),
+    "negative": TaskTemplate("negative", NEGATIVE_TEMPLATE, SCHEMA, RESPONSE_TEMPLATE),
+    "type": TypeInferenceTemplate("type", TYPE_INFERENCE_TEMPLATE, TYPE_SCHEMA + "\n", TYPE_RESPONSE_TEMPLATE, fmt="text"),
+}
+
+
+def make_chat_prompt(api: str, example: str, tokenizer: AutoTokenizer, template: str = "positive") -> str:
+    return TEMPLATES[template].chat_prompt(api, example, tokenizer)
 
 
 class DecoderBase(ABC):
@@ -70,17 +107,105 @@ class DecoderBase(ABC):
         self.trust_remote_code = trust_remote_code
         self.tokenizer_name = tokenizer_name
         self.tokenizer_legacy = tokenizer_legacy
+        self.stats = Counter()
+        self.cache = None
+        self.prompt_store = None
+        self.telemetry = None
 
     @abstractmethod
     def codegen(
-        self, api: str, example: str, negative: bool = False, do_sample: bool = True, num_samples: int = 200
+        self,
+        api: str,
+        example: str,
+        template: str = "positive",
+        do_sample: bool = True,
+        num_samples: int = 200,
+        start_index: int = 0,
+        temperature: float = None,
     ) -> List[str]:
         pass
 
+    def codegen_batch(self, requests: List[dict], do_sample: bool = True) -> List[List[str]]:
+        """
+        Generates samples for many schemas at once; each request holds the `codegen` arguments
+        plus `num_samples`. Requests of different templates can share a batch. Backends that
+        can batch across schemas override this.
+        """
+        outputs = []
+        for request in requests:
+            samples = []
+            while len(samples) < request["num_samples"]:
+                samples += self.codegen(
+                    request["api"],
+                    request["example"],
+                    template=request.get("template", "positive"),
+                    do_sample=do_sample,
+                    num_samples=request["num_samples"] - len(samples),
+                    start_index=request.get("start_index", 0) + len(samples),
+                    temperature=request.get("temperature"),
+                )
+            outputs.append(samples)
+        return outputs
+
+    def codegen_stream(self, requests: List[dict], do_sample: bool = True) -> Iterator[Tuple[int, List[str]]]:
+        """
+        Yields (request index, samples) as they complete. Samples of one request may
+        arrive out of order and in several parts.
+        """
+        yield from enumerate(self.codegen_batch(requests, do_sample=do_sample))
+
     @abstractmethod
     def is_direct_completion(self) -> bool:
         pass
 
+    def compile_prompts(self, requests: List[dict]) -> Optional[List[int]]:
+        """Renders and tokenizes the prompts of a run up front; returns their lengths if the backend supports it."""
+        return None
+
+    def lookup_cache(
+        self,
+        prompt: str,
+        start_index: int,
+        num_samples: int,
+        top_p: float = 1.0,
+        prompt_hash: str = None,
+        temperature: float = None,
+        **extra,
+    ):
+        """Returns the cached samples and one cache key per sample that still has to be generated."""
+        if self.cache is None:
+            return [], [None] * num_samples
+        temperature = self.temperature if temperature is None else temperature
+        prompt_key = self.cache.prompt_key(
+            self.name, prompt, temperature, top_p, self.max_new_tokens, prompt_hash=prompt_hash, **extra
+        )
+        return self.cache.lookup(prompt_key, start_index, num_samples)
+
+    def store_cache(self, keys: List[str], samples: List[str]):
+        if self.cache is not None:
+            self.cache.store(keys, samples)
+
+    def record_request(
+        self,
+        template: Optional[str],
+        num_samples: int,
+        prompt_tokens: int,
+        completion_tokens: int,
+        start: float,
+        end: float,
+        **timings,
+    ):
+        """Reports one engine request; `timings` holds queue_s, prefill_s and decode_s where the backend knows them."""
+        if self.telemetry is not None:
+            self.telemetry.record(self.name, template, num_samples, prompt_tokens, completion_tokens, start, end, **timings)
+
+    def summary(self) -> str:
+        stats = Counter(self.stats)
+        if self.cache is not None:
+            stats["cache_hits"] = self.cache.hits
+            stats["cache_misses"] = self.cache.misses
+        return ", ".join(f"{k}: {v}" for k, v in stats.items())
+
     def __repr__(self) -> str:
         return self.name
 
@@ -88,8 +213,22 @@ class DecoderBase(ABC):
         return self.name
 
 
+def vllm_timings(output) -> dict:
+    """Queue, prefill and decode time of a vLLM RequestOutput, when the engine tracks them."""
+    metrics = getattr(output, "metrics", None)
+    if metrics is None or getattr(metrics, "first_token_time", None) is None:
+        return {}
+    scheduled = metrics.first_scheduled_time or metrics.arrival_time
+    finished = metrics.finished_time or metrics.last_token_time
+    return dict(
+        queue_s=scheduled - metrics.arrival_time,
+        prefill_s=metrics.first_token_time - scheduled,
+        decode_s=finished - metrics.first_token_time,
+    )
+
+
 class VllmDecoder(DecoderBase):
-    def __init__(self, name: str, tp: int, **kwargs) -> None:
+    def __init__(self, name: str, tp: int, enable_prefix_caching: bool = False, **kwargs) -> None:
         super().__init__(name, **kwargs)
 
         kwargs = {
@@ -101,32 +240,92 @@ class VllmDecoder(DecoderBase):
             self.tokenizer_name = self.name
         
         self.tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_name, **kwargs, legacy=self.tokenizer_legacy)
-        self.llm = LLM(model=name, max_model_len=8192, **kwargs)
+        self.llm = LLM(model=name, max_model_len=8192, enable_prefix_caching=enable_prefix_caching, **kwargs)
         self.llm.set_tokenizer(tokenizer=self.tokenizer)
 
     def is_direct_completion(self) -> bool:
         return self.tokenizer.chat_template is None
 
     def codegen(
-        self, prompt: str, do_sample: bool = True, num_samples: int = 200
+        self, prompt: str, do_sample: bool = True, num_samples: int = 200, start_index: int = 0
     ) -> List[str]:
         if do_sample:
             assert self.temperature > 0, "Temperature must be greater than 0!"
         batch_size = min(self.batch_size, num_samples)
+        return self.generate([prompt], [batch_size], do_sample, [start_index])[0]
 
+    def generate(
+        self,
+        prompts: List,
+        num_samples: List[int],
+        do_sample: bool = True,
+        start_indices: List[int] = None,
+        prompt_hashes: List[str] = None,
+        temperatures: List[float] = None,
+        templates: List[str] = None,
+    ) -> List[List[str]]:
+        """`prompts` are either strings or pre-tokenized `{"prompt_token_ids": ...}` inputs with their `prompt_hashes`."""
+        temperatures = [self.temperature if t is None else t for t in temperatures or [None] * len(prompts)]
+        if do_sample:
+            assert min(temperatures) > 0, "Temperature must be greater than 0!"
+        top_p = 0.95 if do_sample else 1.0
+        start_indices = start_indices or [0] * len(prompts)
+        prompt_hashes = prompt_hashes or [None] * len(prompts)
+        templates = templates or [None] * len(prompts)
+
+        # Cached samples bypass the engine; only the missing ones are generated
+        outputs, missing = [], []
+        for prompt, n, start_index, prompt_hash, temperature in zip(
+            prompts, num_samples, start_indices, prompt_hashes, temperatures
+        ):
+            cached, keys = self.lookup_cache(
+                prompt if prompt_hash is None else None,
+                start_index,
+                n,
+                top_p=top_p,
+                prompt_hash=prompt_hash,
+                temperature=temperature,
+            )
+            outputs.append(cached)
+            missing.append(keys)
+        pending = [i for i, keys in enumerate(missing) if keys]
+        if not pending:
+            return outputs
+
+        # Submit everything in one call so that vLLM can batch across prompts, and draw
+        # the samples of each prompt with `n` so that its prefill is shared
+        start = time.time()
         vllm_outputs = self.llm.generate(
-            [prompt] * batch_size,
-            SamplingParams(
-                temperature=self.temperature,
-                max_tokens=self.max_new_tokens,
-                top_p=0.95 if do_sample else 1.0,
-                stop=self.eos,
-            ),
+            [prompts[i] for i in pending],
+            [
+                SamplingParams(
+                    n=len(missing[i]),
+                    temperature=temperatures[i],
+                    max_tokens=self.max_new_tokens,
+                    top_p=top_p,
+                    stop=self.eos,
+                )
+                for i in pending
+            ],
             use_tqdm=False,
         )
-
-        gen_strs = [x.outputs[0].text.replace("\t", "    ") for x in vllm_outputs]
-        return gen_strs
+        end = time.time()
+
+        for i, x in zip(pending, vllm_outputs):
+            n_prompt_tokens = len(x.prompt_token_ids)
+            self.stats["prompt_tokens"] += n_prompt_tokens
+            self.stats["prefill_tokens_saved"] += (len(missing[i]) - 1) * n_prompt_tokens
+            # Only reported by vLLM versions that track prefix cache hits per request
+            self.stats["prefix_cache_hit_tokens"] += getattr(x, "num_cached_tokens", None) or 0
+            samples = [o.text.replace("\t", "    ") for o in x.outputs]
+            n_completion_tokens = sum(len(o.token_ids) for o in x.outputs)
+            self.stats["completion_tokens"] += n_completion_tokens
+            self.record_request(
+                templates[i], len(samples), n_prompt_tokens, n_completion_tokens, start, end, **vllm_timings(x)
+            )
+            self.store_cache(missing[i], samples)
+            outputs[i] += samples
+        return outputs
 
 
 class GeneralVllmDecoder(VllmDecoder):
@@ -134,46 +333,150 @@ class GeneralVllmDecoder(VllmDecoder):
         super().__init__(name, **kwargs)
         self.eos += ["\n```\n"]
         print(f"EOS strings: {self.eos}")
+        # Any change to the templates or the chat template invalidates the compiled prompts
+        parts = [self.tokenizer_name, self.tokenizer.chat_template or ""]
+        for template in TEMPLATES.values():
+            parts += [template.name, template.instruction, template.schema, template.response]
+        self.template_digest = hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+    def prompt_inputs(self, requests: List[dict]) -> Tuple[List, Optional[List[str]]]:
+        """Engine inputs for the requests, served as token ids from the prompt store when one is set."""
+        templates = [TEMPLATES[request.get("template", "positive")] for request in requests]
+        if self.prompt_store is None:
+            return [
+                template.chat_prompt(request["api"], request["example"], self.tokenizer)
+                for template, request in zip(templates, requests)
+            ], None
+        keys = [
+            hashlib.sha256(
+                canonical_json([self.template_digest, template.name, request["api"], request["example"]]).encode("utf-8")
+            ).hexdigest()
+            for template, request in zip(templates, requests)
+        ]
+        n_compiled = len(self.prompt_store)
+        compiled = self.prompt_store.compile(
+            keys,
+            lambda i: templates[i].chat_prompt(requests[i]["api"], requests[i]["example"], self.tokenizer),
+            # Same defaults as vLLM uses when it tokenizes a text prompt
+            lambda texts: self.tokenizer(texts).input_ids,
+        )
+        self.stats["prompts_tokenized"] += len(self.prompt_store) - n_compiled
+        return [{"prompt_token_ids": ids.tolist()} for ids, _ in compiled], [text_hash for _, text_hash in compiled]
+
+    def compile_prompts(self, requests: List[dict]) -> Optional[List[int]]:
+        if self.prompt_store is None:
+            return None
+        prompts, _ = self.prompt_inputs(requests)
+        return [len(prompt["prompt_token_ids"]) for prompt in prompts]
 
     def codegen(
-        self, api: str, example: str, negative: bool = False, do_sample: bool = True, num_samples: int = 200
+        self,
+        api: str,
+        example: str,
+        template: str = "positive",
+        do_sample: bool = True,
+        num_samples: int = 200,
+        start_index: int = 0,
+        temperature: float = None,
     ) -> List[str]:
-        prompt = make_chat_prompt(api, example, self.tokenizer, negative=negative)
-        return VllmDecoder.codegen(self, prompt, do_sample, num_samples)
+        request = dict(
+            api=api,
+            example=example,
+            template=template,
+            num_samples=min(self.batch_size, num_samples),
+            start_index=start_index,
+            temperature=temperature,
+        )
+        return self.codegen_batch([request], do_sample=do_sample)[0]
+
+    def codegen_batch(self, requests: List[dict], do_sample: bool = True) -> List[List[str]]:
+        prompts, prompt_hashes = self.prompt_inputs(requests)
+        return VllmDecoder.generate(
+            self,
+            prompts,
+            [request["num_samples"] for request in requests],
+            do_sample,
+            [request.get("start_index", 0) for request in requests],
+            prompt_hashes,
+            [request.get("temperature") for request in requests],
+            [request.get("template", "positive") for request in requests],
+        )
 
 
 class OpenAIChatDecoder(DecoderBase):
-    def __init__(self, name: str, base_url=None, **kwargs) -> None:
+    def __init__(self, name: str, base_url=None, retry: openai_request.RetryPolicy = None, **kwargs) -> None:
         super().__init__(name, **kwargs)
-        self.client = openai.OpenAI(base_url=base_url)
-
-    def codegen(
-        self, api: str, example: str, negative: bool = False, do_sample: bool = True, num_samples: int = 200
-    ) -> List[str]:
-        if do_sample:
-            assert self.temperature > 0, "Temperature must be positive for sampling"
-        batch_size = min(self.batch_size, num_samples)
-
-        # construct prompt
-        fmt = "json_object"
-        if negative:
-            message = NEGATIVE_TEMPLATE.format(api=api, example=example) + "\n" + SCHEMA + RESPONSE_TEMPLATE.split("```json")[0]
+        # Retries are left to the policy, which backs off and keeps count of them
+        self.retry = retry or openai_request.RetryPolicy()
+        # Several base urls are load balanced, each request going to the least-loaded one
+        base_urls = base_url if isinstance(base_url, (list, tuple)) else [base_url]
+        self.endpoints = openai_request.EndpointPool(base_urls) if len(base_urls) > 1 else None
+        if self.endpoints is not None:
+            self.client = {url: openai.OpenAI(base_url=url, max_retries=0) for url in base_urls}
         else:
-            message = POSITIVE_TEMPLATE.format(api=api, example=examplem) + "\n" + SCHEMA + RESPONSE_TEMPLATE.split("```json")[0]
+            self.client = openai.OpenAI(base_url=base_urls[0], max_retries=0)
+        self.base_url = base_urls[0]
 
-        ret = openai_request.make_auto_request(
-            self.client,
+    def make_message(self, api: str, example: str, template: str = "positive") -> str:
+        return TEMPLATES[template].message(api, example)
+
+    def make_payload(self, message: str, n: int, fmt: str = "json_object", temperature: float = None) -> dict:
+        return dict(
             message=message,
             model=self.name,
             max_tokens=self.max_new_tokens,
-            temperature=self.temperature,
-            n=batch_size,
+            temperature=self.temperature if temperature is None else temperature,
+            n=n,
             response_format={"type": fmt},
         )
 
+    def codegen(
+        self,
+        api: str,
+        example: str,
+        template: str = "positive",
+        do_sample: bool = True,
+        num_samples: int = 200,
+        start_index: int = 0,
+        temperature: float = None,
+    ) -> List[str]:
+        temperature = self.temperature if temperature is None else temperature
+        if do_sample:
+            assert temperature > 0, "Temperature must be positive for sampling"
+        batch_size = min(self.batch_size, num_samples)
+        fmt = TEMPLATES[template].fmt
+
+        # construct prompt
+        message = self.make_message(api, example, template=template)
+        contents, missing = self.lookup_cache(
+            message, start_index, batch_size, temperature=temperature, response_format=fmt
+        )
+        if missing:
+            start = time.time()
+            ret = openai_request.make_auto_request(
+                self.client,
+                policy=self.retry,
+                endpoints=self.endpoints,
+                **self.make_payload(message, len(missing), fmt, temperature),
+            )
+            self.record_usage(template, ret, start, time.time())
+            samples = [item.message.content for item in ret.choices]
+            self.store_cache(missing, samples)
+            contents += samples
+        return self.parse_response(contents, fmt)
+
+    def record_usage(self, template: str, ret, start: float, end: float, **timings):
+        usage = getattr(ret, "usage", None)
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        self.stats["prompt_tokens"] += prompt_tokens
+        self.stats["completion_tokens"] += completion_tokens
+        self.record_request(template, len(ret.choices), prompt_tokens, completion_tokens, start, end, **timings)
+
+    @staticmethod
+    def parse_response(contents: List[str], fmt: str = "json_object") -> List[str]:
         outputs = []
-        for item in ret.choices:
-            content = item.message.content
+        for content in contents:
             # if json serializable
             if fmt == "json_object":
                 try:
@@ -193,10 +496,184 @@ class OpenAIChatDecoder(DecoderBase):
 
         return outputs
 
+    def summary(self) -> str:
+        summary = ", ".join(filter(None, [super().summary(), self.retry.summary()]))
+        if self.endpoints is not None:
+            summary += "\n" + self.endpoints.summary()
+        return summary
+
+    def is_direct_completion(self) -> bool:
+        return False
+
+
+class AsyncOpenAIChatDecoder(OpenAIChatDecoder):
+    def __init__(
+        self,
+        name: str,
+        base_url=None,
+        concurrency: int = 16,
+        timeout: float = 100,
+        autotune: openai_request.AIMDController = None,
+        **kwargs,
+    ) -> None:
+        super().__init__(name, base_url=base_url, **kwargs)
+        self.concurrency = concurrency
+        self.timeout = timeout
+        # The controller outlives each batch, so the learned limit carries over
+        self.autotune = autotune
+
+    def codegen_stream(self, requests: List[dict], do_sample: bool = True) -> Iterator[Tuple[int, List[str]]]:
+        # Serve cached samples right away and split the rest into API calls of at most batch_size samples
+        payloads, owners = [], []
+        for i, request in enumerate(requests):
+            template = TEMPLATES[request.get("template", "positive")]
+            temperature = request.get("temperature")
+            temperature = self.temperature if temperature is None else temperature
+            if do_sample:
+                assert temperature > 0, "Temperature must be positive for sampling"
+            message = template.message(request["api"], request["example"])
+            contents, missing = self.lookup_cache(
+                message,
+                request.get("start_index", 0),
+                request["num_samples"],
+                temperature=temperature,
+                response_format=template.fmt,
+            )
+            if contents:
+                yield i, self.parse_response(contents, template.fmt)
+            for start in range(0, len(missing), self.batch_size):
+                keys = missing[start:start + self.batch_size]
+                payloads.append(self.make_payload(message, len(keys), template.fmt, temperature))
+                owners.append((i, keys, template))
+
+        for j, ret, (queued, started, finished) in openai_request.stream_async_requests(
+            lambda base_url: openai.AsyncOpenAI(base_url=base_url or self.base_url, max_retries=0),
+            payloads,
+            concurrency=self.concurrency,
+            timeout=self.timeout,
+            policy=self.retry,
+            endpoints=self.endpoints,
+            autotune=self.autotune,
+        ):
+            i, keys, template = owners[j]
+            state = self.autotune.state() if self.autotune is not None else {}
+            if state and self.telemetry is not None:
+                self.telemetry.set_gauges(state)
+            self.record_usage(template.name, ret, queued, finished, queue_s=started - queued, **state)
+            samples = [item.message.content for item in ret.choices]
+            self.store_cache(keys, samples)
+            yield i, self.parse_response(samples, template.fmt)
+
+    def codegen_batch(self, requests: List[dict], do_sample: bool = True) -> List[List[str]]:
+        outputs = [[] for _ in requests]
+        for i, samples in self.codegen_stream(requests, do_sample=do_sample):
+            outputs[i] += samples
+        return outputs
+
+    def summary(self) -> str:
+        summary = super().summary()
+        if self.autotune is not None:
+            state = self.autotune.state()
+            summary += f"\nconcurrency limit: {state['concurrency_limit']} after {state['concurrency_cuts']} cuts"
+        return summary
+
+
+class FakeDecoder(DecoderBase):
+    """
+    Deterministic stand-in for a model that needs no GPU or API key. Each batch sleeps
+    `latency + token_latency * num_tokens` seconds and times out with probability `fail_rate`;
+    like an API call, it is retried through `retry`, so that the policy and its breaker can be
+    load tested.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        latency: float = 0.0,
+        token_latency: float = 0.0,
+        num_tokens: int = 64,
+        fail_rate: float = 0.0,
+        seed: int = 0,
+        retry: openai_request.RetryPolicy = None,
+        **kwargs,
+    ) -> None:
+        super().__init__(name, **kwargs)
+        self.retry = retry or openai_request.RetryPolicy()
+        self.latency = latency
+        self.token_latency = token_latency
+        self.num_tokens = num_tokens
+        self.fail_rate = fail_rate
+        self.rng = random.Random(seed)
+
+    def codegen(
+        self,
+        api: str,
+        example: str,
+        template: str = "positive",
+        do_sample: bool = True,
+        num_samples: int = 200,
+        start_index: int = 0,
+        temperature: float = None,
+    ) -> List[str]:
+        request = dict(
+            api=api,
+            example=example,
+            template=template,
+            num_samples=min(self.batch_size, num_samples),
+            start_index=start_index,
+        )
+        return self.codegen_batch([request], do_sample=do_sample)[0]
+
+    def codegen_batch(self, requests: List[dict], do_sample: bool = True) -> List[List[str]]:
+        return self.retry.call(self.step, requests)
+
+    def step(self, requests: List[dict]) -> List[List[str]]:
+        # A batch costs one engine step, as it would on a batched backend
+        start = time.time()
+        time.sleep(self.latency + self.token_latency * self.num_tokens)
+        if self.rng.random() < self.fail_rate:
+            self.stats["failures"] += 1
+            raise TimeoutError("Injected timeout of the fake backend")
+
+        outputs = []
+        for request in requests:
+            template = TEMPLATES[request.get("template", "positive")]
+            prompt = template.message(request["api"], request["example"])
+            start_index = request.get("start_index", 0)
+            outputs.append([
+                fake_completion(prompt, start_index + k, self.num_tokens, return_type=template.name == "type")
+                for k in range(request["num_samples"])
+            ])
+            self.stats["prompt_tokens"] += len(prompt.split())
+            self.stats["completion_tokens"] += self.num_tokens * request["num_samples"]
+            self.record_request(
+                template.name,
+                request["num_samples"],
+                len(prompt.split()),
+                self.num_tokens * request["num_samples"],
+                start,
+                time.time(),
+                queue_s=0.0,
+                prefill_s=self.latency,
+                decode_s=self.token_latency * self.num_tokens,
+            )
+        return outputs
+
+    def summary(self) -> str:
+        return ", ".join(filter(None, [super().summary(), self.retry.summary()]))
+
     def is_direct_completion(self) -> bool:
         return False
 
 
+def make_retry_policy() -> openai_request.RetryPolicy:
+    # Retry limits come from the environment as well; unset means 10 attempts and no deadline
+    return openai_request.RetryPolicy(
+        max_attempts=int(os.getenv("RETRY_MAX_ATTEMPTS", 10)),
+        deadline=float(os.environ["RETRY_DEADLINE"]) if os.getenv("RETRY_DEADLINE") else None,
+    )
+
+
 def make_model(
     model: str,
     backend: str,
@@ -207,6 +684,9 @@ def make_model(
     trust_remote_code=False,
     tokenizer_name=None,
     tokenizer_legacy=True,
+    enable_prefix_caching=False,
+    concurrency=1,
+    max_concurrency=None,
 ):
     if backend == "vllm":
         return GeneralVllmDecoder(
@@ -217,11 +697,39 @@ def make_model(
             trust_remote_code=trust_remote_code,
             tokenizer_name=tokenizer_name,
             tokenizer_legacy=tokenizer_legacy,
+            enable_prefix_caching=enable_prefix_caching,
+        )
+    elif backend == "fake":
+        # Knobs of the fake backend come from the environment, like VLLM_N_GPUS
+        return FakeDecoder(
+            name=model,
+            batch_size=batch_size,
+            temperature=temperature,
+            latency=float(os.getenv("FAKE_LATENCY", 0)),
+            token_latency=float(os.getenv("FAKE_TOKEN_LATENCY", 0)),
+            num_tokens=int(os.getenv("FAKE_TOKENS", 64)),
+            fail_rate=float(os.getenv("FAKE_FAIL_RATE", 0)),
+            seed=int(os.getenv("FAKE_SEED", 0)),
+            retry=make_retry_policy(),
         )
     elif backend == "openai":
+        retry = make_retry_policy()
+        if concurrency > 1 or max_concurrency:
+            # With max_concurrency, the in-flight requests start at `concurrency` and adapt up to it
+            autotune = openai_request.AIMDController(concurrency, max_limit=max_concurrency) if max_concurrency else None
+            return AsyncOpenAIChatDecoder(
+                name=model,
+                batch_size=batch_size,
+                temperature=temperature,
+                base_url=base_url,
+                concurrency=concurrency,
+                retry=retry,
+                autotune=autotune,
+            )
         return OpenAIChatDecoder(
             name=model,
             batch_size=batch_size,
             temperature=temperature,
             base_url=base_url,
+            retry=retry,
         )
@@ -1,19 +1,26 @@
-import signal
 import time
+import queue
+import random
+import asyncio
+import threading
+import contextlib
+from collections import Counter, deque
+from email.utils import parsedate_to_datetime
+from typing import Callable, Iterator, List, Optional, Tuple
 
 import openai
 from openai.types.chat import ChatCompletion
 
 
-def make_request(
-    client: openai.Client,
+def chat_body(
     message: str,
     model: str,
     max_tokens: int = 512,
     temperature: float = 1,
     n: int = 1,
     **kwargs
-) -> ChatCompletion:
+) -> dict:
+    """Arguments of a chat completion, also the body of a line of an OpenAI batch file."""
     system_msg = "You are a helpful assistant good at coding."
     if (
         kwargs.get("response_format", None)
@@ -21,7 +28,7 @@ def make_request(
     ):
         system_msg = "You are a helpful assistant designed to output JSON."
 
-    return client.chat.completions.create(
+    return dict(
         model=model,
         messages=[
             {"role": "system", "content": system_msg},
@@ -34,33 +41,452 @@ def make_request(
     )
 
 
-def handler(signum, frame):
-    # swallow signum and frame
-    raise Exception("end of time")
+def make_request(client: openai.Client, *args, **kwargs) -> ChatCompletion:
+    return client.chat.completions.create(**chat_body(*args, **kwargs))
+
+
+class RetryPolicy:
+    """
+    Retries of the API requests of one run: exponential backoff with full jitter, or the
+    server's Retry-After, up to `max_attempts` attempts or `deadline` seconds per request.
+    After `breaker_threshold` consecutive failures the circuit opens and every request waits
+    `breaker_cooldown` seconds, then a single probe decides whether traffic resumes. The
+    state is behind a lock, and waiting is left to the caller, so that one policy serves
+    threads and event loops alike.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 10,
+        deadline: float = None,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        breaker_threshold: int = 20,
+        breaker_cooldown: float = 30.0,
+    ) -> None:
+        self.max_attempts = max_attempts
+        self.deadline = deadline
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.open_until = 0.0
+        self.probing = False
+        self.stats = Counter()
 
+    @staticmethod
+    def classify(e: BaseException) -> Optional[str]:
+        """The kind of a retryable error, or None if retrying cannot help."""
+        if isinstance(e, openai.RateLimitError):
+            return "rate_limited"
+        if isinstance(e, (openai.APITimeoutError, asyncio.TimeoutError, TimeoutError)):
+            return "timeouts"
+        if isinstance(e, openai.APIConnectionError):
+            return "connection_errors"
+        if isinstance(e, openai.APIStatusError):
+            return "server_errors" if e.status_code >= 500 or e.status_code in (408, 409) else None
+        if isinstance(e, openai.APIError):
+            return "api_errors"
+        return None
 
-def make_auto_request(*args, **kwargs) -> ChatCompletion:
-    ret = None
-    while ret is None:
+    @staticmethod
+    def retry_after(e: BaseException) -> Optional[float]:
+        headers = getattr(getattr(e, "response", None), "headers", None) or {}
         try:
-            signal.signal(signal.SIGALRM, handler)
-            signal.alarm(100)
-            ret = make_request(*args, **kwargs)
-            signal.alarm(0)
-        except openai.RateLimitError:
-            print("Rate limit exceeded. Waiting...")
-            signal.alarm(0)
-            time.sleep(5)
-        except openai.APIConnectionError:
-            print("API connection error. Waiting...")
-            signal.alarm(0)
-            time.sleep(5)
-        except openai.APIError as e:
-            print(e)
-            signal.alarm(0)
-        except Exception as e:
-            print("Unknown error. Waiting...")
-            print(e)
-            signal.alarm(0)
-            time.sleep(1)
-    return ret
+            if headers.get("retry-after-ms") is not None:
+                return float(headers["retry-after-ms"]) / 1000
+            if headers.get("retry-after") is not None:
+                value = headers["retry-after"]
+                try:
+                    return float(value)
+                except ValueError:
+                    return parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            pass
+        return None
+
+    def admit(self, started: float) -> float:
+        """Seconds to wait before the next attempt may be sent, 0 if it may go now."""
+        with self.lock:
+            now = time.time()
+            if self.deadline is not None and now - started > self.deadline:
+                self.stats["failed"] += 1
+                raise TimeoutError(f"Circuit open past the request deadline of {self.deadline}s")
+            if now < self.open_until:
+                return self.open_until - now
+            if self.open_until:
+                if self.probing:
+                    return min(1.0, self.breaker_cooldown)
+                self.probing = True
+            self.stats["attempts"] += 1
+            return 0.0
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.open_until = 0.0
+            self.probing = False
+
+    def failure(self, e: BaseException, attempt: int, started: float) -> float:
+        """Records a failed attempt and returns the delay before the next one, or raises if it is the last."""
+        kind = self.classify(e)
+        with self.lock:
+            if kind is None:
+                # A request the server rejects says nothing about its health, nor does it as a probe
+                self.probing = False
+                self.stats["failed"] += 1
+                raise e
+            self.failures += 1
+            if self.probing or self.failures >= self.breaker_threshold:
+                if not self.open_until or self.probing:
+                    self.stats["breaker_opened"] += 1
+                self.open_until = time.time() + self.breaker_cooldown
+                self.probing = False
+            delay = self.retry_after(e)
+            if delay is None:
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+            delay = max(0.0, delay)
+            over_deadline = self.deadline is not None and time.time() + delay - started > self.deadline
+            if attempt >= self.max_attempts or over_deadline:
+                self.stats["failed"] += 1
+                raise e
+            self.stats[kind] += 1
+            self.stats["retries"] += 1
+            return delay
+
+    def summary(self) -> str:
+        with self.lock:
+            return ", ".join(f"{k}: {v}" for k, v in self.stats.items())
+
+    def call(self, fn: Callable, *args, **kwargs):
+        started = time.time()
+        attempt = 0
+        while True:
+            wait = self.admit(started)
+            if wait:
+                time.sleep(wait)
+                continue
+            attempt += 1
+            try:
+                ret = fn(*args, **kwargs)
+            except Exception as e:
+                time.sleep(self.failure(e, attempt, started))
+            else:
+                self.success()
+                return ret
+
+    async def call_async(self, fn: Callable, *args, **kwargs):
+        started = time.time()
+        attempt = 0
+        while True:
+            wait = self.admit(started)
+            if wait:
+                await asyncio.sleep(wait)
+                continue
+            attempt += 1
+            try:
+                ret = await asyncio.wait_for(fn(*args, **kwargs), kwargs.get("timeout"))
+            except Exception as e:
+                await asyncio.sleep(self.failure(e, attempt, started))
+            else:
+                self.success()
+                return ret
+
+
+class Endpoint:
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.in_flight = 0
+        self.latency = None
+        self.failures = 0
+        self.down_until = 0.0
+        self.stats = Counter()
+
+
+class EndpointPool:
+    """
+    Routes each attempt to the least-loaded healthy endpoint: the one with the smallest
+    (in-flight requests + 1) x EWMA latency, endpoints without a latency yet going first.
+    An endpoint that fails `max_failures` times in a row is skipped for `cooldown` seconds,
+    so the retries of its requests fail over to the others.
+    """
+
+    def __init__(self, urls: List[str], max_failures: int = 3, cooldown: float = 30.0, alpha: float = 0.2) -> None:
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.alpha = alpha
+        self.lock = threading.Lock()
+        self.started = None
+
+    @property
+    def urls(self) -> List[str]:
+        return [endpoint.url for endpoint in self.endpoints]
+
+    def acquire(self) -> Endpoint:
+        with self.lock:
+            now = time.time()
+            self.started = self.started or now
+            healthy = [endpoint for endpoint in self.endpoints if endpoint.down_until <= now]
+            if not healthy:
+                # Everything is down: try the endpoint that comes back first
+                healthy = [min(self.endpoints, key=lambda endpoint: endpoint.down_until)]
+            endpoint = min(
+                healthy,
+                key=lambda endpoint: (endpoint.latency is not None, (endpoint.in_flight + 1) * (endpoint.latency or 1)),
+            )
+            endpoint.in_flight += 1
+            return endpoint
+
+    def release(self, endpoint: Endpoint, start: float, ret: ChatCompletion = None, error: BaseException = None):
+        with self.lock:
+            latency = time.time() - start
+            endpoint.in_flight -= 1
+            endpoint.stats["requests"] += 1
+            endpoint.stats["busy_s"] += latency
+            if error is not None:
+                endpoint.stats["errors"] += 1
+                endpoint.failures += 1
+                if endpoint.failures >= self.max_failures:
+                    endpoint.down_until = time.time() + self.cooldown
+                    endpoint.failures = self.max_failures - 1
+                return
+            endpoint.failures = 0
+            endpoint.latency = latency if endpoint.latency is None else (1 - self.alpha) * endpoint.latency + self.alpha * latency
+            endpoint.stats["samples"] += len(ret.choices)
+            endpoint.stats["completion_tokens"] += getattr(getattr(ret, "usage", None), "completion_tokens", 0) or 0
+
+    def summary(self) -> str:
+        with self.lock:
+            elapsed = max(time.time() - (self.started or time.time()), 1e-9)
+            return "\n".join(
+                f"{endpoint.url}: {endpoint.stats['requests']} requests, {endpoint.stats['errors']} errors, "
+                f"{endpoint.stats['samples'] / elapsed:.2f} samples/s, {endpoint.stats['completion_tokens'] / elapsed:.1f} tok/s, "
+                f"latency {endpoint.latency or 0:.2f}s"
+                for endpoint in self.endpoints
+            )
+
+
+class AIMDController:
+    """
+    Adaptive limit on the requests in flight. The limit grows by `increase` per limit's worth
+    of successful requests while their latency stays within `latency_tolerance` x the best
+    latency seen, and is multiplied by `decrease` on a 429 or a timeout, at most once per
+    latency, so that one burst of errors only cuts it once.
+    """
+
+    def __init__(
+        self,
+        initial: int = 16,
+        min_limit: int = 1,
+        max_limit: int = 256,
+        increase: float = 1.0,
+        decrease: float = 0.5,
+        latency_tolerance: float = 2.0,
+        alpha: float = 0.2,
+    ) -> None:
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.alpha = alpha
+        self.latency = None
+        self.best_latency = None
+        self.last_cut = 0.0
+        self.lock = threading.Lock()
+        self.stats = Counter()
+
+    def allowed(self) -> int:
+        return int(self.limit)
+
+    def success(self, latency: float):
+        with self.lock:
+            self.latency = latency if self.latency is None else (1 - self.alpha) * self.latency + self.alpha * latency
+            self.best_latency = min(self.best_latency or self.latency, self.latency)
+            if self.latency <= self.latency_tolerance * self.best_latency:
+                self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+            else:
+                self.stats["latency_holds"] += 1
+
+    def failure(self, e: BaseException):
+        kind = RetryPolicy.classify(e)
+        with self.lock:
+            self.stats["errors"] += 1
+            if kind not in ("rate_limited", "timeouts"):
+                return
+            now = time.time()
+            if now - self.last_cut >= (self.latency or 0):
+                self.limit = max(self.min_limit, self.limit * self.decrease)
+                self.last_cut = now
+                self.stats["cuts"] += 1
+
+    def state(self) -> dict:
+        with self.lock:
+            return dict(
+                concurrency_limit=self.allowed(),
+                concurrency_latency_s=self.latency or 0.0,
+                concurrency_best_latency_s=self.best_latency or 0.0,
+                concurrency_cuts=self.stats["cuts"],
+            )
+
+
+class AdaptiveGate:
+    """Holds attempts back on one event loop while the controller's limit is reached."""
+
+    def __init__(self, controller: AIMDController) -> None:
+        self.controller = controller
+        self.in_flight = 0
+        self.waiters = deque()
+
+    async def acquire(self):
+        while self.in_flight >= self.controller.allowed():
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+        self.in_flight += 1
+
+    def release(self, start: float, error: BaseException = None):
+        self.in_flight -= 1
+        if error is None:
+            self.controller.success(time.time() - start)
+        elif not isinstance(error, asyncio.CancelledError):
+            self.controller.failure(error)
+        for _ in range(max(0, self.controller.allowed() - self.in_flight)):
+            if not self.waiters:
+                break
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+
+def make_auto_request(
+    client, *args, timeout: float = 100, policy: RetryPolicy = None, endpoints: EndpointPool = None, **kwargs
+) -> ChatCompletion:
+    """With `endpoints`, `client` maps each endpoint url to its client and every attempt is routed by the pool."""
+    # The client enforces the timeout, which unlike SIGALRM also works off the main thread
+    policy = policy or RetryPolicy()
+    if endpoints is None:
+        return policy.call(make_request, client, *args, timeout=timeout, **kwargs)
+
+    def attempt():
+        endpoint, start = endpoints.acquire(), time.time()
+        try:
+            ret = make_request(client[endpoint.url], *args, timeout=timeout, **kwargs)
+        except BaseException as e:
+            endpoints.release(endpoint, start, error=e)
+            raise
+        endpoints.release(endpoint, start, ret=ret)
+        return ret
+
+    return policy.call(attempt)
+
+
+async def make_async_request(client: openai.AsyncOpenAI, *args, **kwargs) -> ChatCompletion:
+    return await client.chat.completions.create(**chat_body(*args, **kwargs))
+
+
+async def make_auto_async_request(
+    client,
+    *args,
+    timeout: float = 100,
+    policy: RetryPolicy = None,
+    endpoints: EndpointPool = None,
+    gate: AdaptiveGate = None,
+    **kwargs
+) -> ChatCompletion:
+    """Each attempt holds a slot of `gate` and, with `endpoints`, goes to the endpoint the pool picks."""
+    policy = policy or RetryPolicy()
+    if endpoints is None and gate is None:
+        return await policy.call_async(make_async_request, client, *args, timeout=timeout, **kwargs)
+
+    async def attempt():
+        if gate is not None:
+            await gate.acquire()
+        endpoint = endpoints.acquire() if endpoints is not None else None
+        start = time.time()
+        try:
+            target = client[endpoint.url] if endpoint is not None else client
+            # The timeout starts once the request is sent, not while it waits for the gate
+            ret = await asyncio.wait_for(make_async_request(target, *args, timeout=timeout, **kwargs), timeout)
+        except BaseException as e:
+            if endpoint is not None:
+                endpoints.release(endpoint, start, error=e)
+            if gate is not None:
+                gate.release(start, error=e)
+            raise
+        if endpoint is not None:
+            endpoints.release(endpoint, start, ret=ret)
+        if gate is not None:
+            gate.release(start)
+        return ret
+
+    return await policy.call_async(attempt)
+
+
+def stream_async_requests(
+    make_client: Callable[[Optional[str]], openai.AsyncOpenAI],
+    payloads: List[dict],
+    concurrency: int = 16,
+    timeout: float = 100,
+    policy: RetryPolicy = None,
+    endpoints: EndpointPool = None,
+    autotune: AIMDController = None,
+) -> Iterator[Tuple[int, ChatCompletion, Tuple[float, float, float]]]:
+    """
+    Sends the payloads with at most `concurrency` requests in flight and yields
+    (payload index, response, (queued, started, finished) times) in completion order.
+    The event loop runs on a background thread so that the caller can write results
+    while requests are pending. `make_client(base_url)` is called on that thread, once per
+    endpoint of `endpoints` or once with None. With `autotune`, the controller's limit
+    replaces `concurrency` and each retry waits for a slot again. A request that still fails
+    after its retries is reported and skipped rather than ending the stream, so that a
+    --resume run can sample it again.
+    """
+    results = queue.Queue()
+    done = object()
+
+    async def run():
+        client = {url: make_client(url) for url in endpoints.urls} if endpoints is not None else make_client(None)
+        gate = AdaptiveGate(autotune) if autotune is not None else None
+        semaphore = asyncio.Semaphore(concurrency) if gate is None else contextlib.nullcontext()
+
+        async def worker(i, payload):
+            queued = time.time()
+            async with semaphore:
+                started = time.time()
+                try:
+                    ret = await make_auto_async_request(
+                        client, timeout=timeout, policy=policy, endpoints=endpoints, gate=gate, **payload
+                    )
+                except Exception as e:
+                    ret = e
+            results.put((i, ret, (queued, started, time.time())))
+
+        try:
+            await asyncio.gather(*(worker(i, payload) for i, payload in enumerate(payloads)))
+        except BaseException as e:
+            results.put(e)
+        finally:
+            results.put(done)
+
+    thread = threading.Thread(target=asyncio.run, args=(run(),), daemon=True)
+    thread.start()
+    while True:
+        item = results.get()
+        if item is done:
+            break
+        if isinstance(item, BaseException):
+            raise item
+        if isinstance(item[1], Exception):
+            print(f"Request {item[0]} failed and is skipped: {item[1]!r}")
+            continue
+        yield item
+    thread.join()
@@ -0,0 +1,174 @@
+import json
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List
+
+from rich.progress import Progress
+
+from writer import WriterPool
+from dedup import OnlineDedup
+from prompt_store import prompt_length_report
+from example_window import count_tokens
+
+
+def build_samples(job: Dict, completions: List[str]) -> List[Dict]:
+    """Output rows for a job; a union job writes every completion for each of its call sites."""
+    sites = job.get("sites", [dict(id_num=job["id_num"], task_id=job["task_id"])])
+    return [
+        dict(
+            id_num=site["id_num"],
+            task_id=site["task_id"],
+            api_name=job["api"]["name"],
+            synthesis=completion,
+            **({"union_id": job["union_id"]} if "union_id" in job else {}),
+        )
+        for completion in completions
+        for site in sites
+    ]
+
+
+def chunk_jobs(jobs: List[Dict], chunk_size: int) -> Iterable[List[Dict]]:
+    """Group jobs so that each chunk holds about `chunk_size` sequences."""
+    chunk, n_sequences = [], 0
+    for job in jobs:
+        chunk.append(job)
+        n_sequences += job["num_samples"]
+        if n_sequences >= chunk_size:
+            yield chunk
+            chunk, n_sequences = [], 0
+    if chunk:
+        yield chunk
+
+
+def schedule_jobs(jobs: List[Dict], lengths: List[int] = None, window: int = None) -> List[List[int]]:
+    """
+    Submission order of the jobs, in windows of consecutive jobs of about `window` sequences
+    each, or one window without it. Within a window, jobs that share an example stay together,
+    shortest first, and the groups go from the shortest prompts to the longest, so that each
+    chunk holds prompts of about one length. Without compiled `lengths`, prompt lengths are estimated.
+    """
+    if lengths is None:
+        lengths = [count_tokens(json.dumps(job["api"])) + count_tokens(job["example"]) for job in jobs]
+    windows, current, n_sequences = [], [], 0
+    for j, job in enumerate(jobs):
+        current.append(j)
+        n_sequences += job["num_samples"]
+        if window is not None and n_sequences >= window:
+            windows.append(current)
+            current, n_sequences = [], 0
+    if current:
+        windows.append(current)
+
+    order = []
+    for window_jobs in windows:
+        groups = defaultdict(list)
+        for j in window_jobs:
+            groups[jobs[j]["example"]].append(j)
+        groups = sorted(groups.values(), key=lambda group: (max(lengths[j] for j in group), group[0]))
+        order.append([j for group in groups for j in sorted(group, key=lambda j: (lengths[j], j))])
+    return order
+
+
+class ReorderBuffer:
+    """Holds the samples of finished jobs until every earlier job has finished, so the output keeps the job order."""
+
+    def __init__(self, n_jobs: int) -> None:
+        self.samples = defaultdict(list)
+        self.finished = [False] * n_jobs
+        self.next = 0
+
+    def add(self, j: int, samples: List[Dict], finished: bool) -> List[tuple]:
+        """Buffers the samples of job `j` and returns the (job, samples) that can now be written."""
+        self.samples[j].extend(samples)
+        self.finished[j] = self.finished[j] or finished
+        released = []
+        while self.next < len(self.finished) and self.finished[self.next]:
+            released.append((self.next, self.samples.pop(self.next, [])))
+            self.next += 1
+        return released
+
+
+def make_request(job: Dict) -> Dict:
+    return {k: job[k] for k in ("api", "example", "num_samples", "start_index", "template", "temperature") if k in job}
+
+
+def run_batched(
+    p: Progress,
+    model,
+    jobs: List[Dict],
+    save_path: str,
+    existing: Counter = None,
+    do_sample: bool = True,
+    chunk_size: int = 1024,
+    writers: WriterPool = None,
+    dedup: OnlineDedup = None,
+    schedule: bool = False,
+    schedule_window: int = 8,
+):
+    """
+    Renders the prompts of many schemas up front and submits them in large batches,
+    then routes the completions back to their (task_id, id_num) and, for multi-template
+    runs, to the job's own `save_path`. Samples go through `writers`, which the caller closes.
+    With `dedup`, samples are drawn in rounds and a job stops once it has enough distinct samples.
+    With `schedule`, the jobs are submitted in `schedule_jobs` order, a window of about
+    `schedule_window` chunks at a time, and the samples are held back until they can be
+    written in job order, i.e. by (id_num, sample index), so at most a window is held back.
+    """
+    own_writers = writers is None
+    writers = writers or WriterPool()
+    lengths = model.compile_prompts([make_request(job) for job in jobs])
+    if lengths:
+        p.console.print(f"Compiled prompts: {prompt_length_report(lengths)}")
+    task = p.add_task("Batched generation", total=sum(job["num_samples"] for job in jobs))
+    reorder = ReorderBuffer(len(jobs)) if schedule else None
+
+    def write(j: int, samples: List[Dict], finished: bool):
+        released = reorder.add(j, samples, finished) if reorder is not None else [(j, samples)]
+        for j, samples in released:
+            # Jobs of different templates carry their own output file and resume counts
+            writers.write(jobs[j].get("save_path", save_path), samples)
+            counts = jobs[j].get("existing", existing)
+            if counts is not None:
+                for sample in samples:
+                    counts[(sample["task_id"], sample["id_num"])] += 1
+
+    # Each window is generated to the end before the next, so held back samples never span more than one
+    windows = schedule_jobs(jobs, lengths, chunk_size * schedule_window) if schedule else [list(range(len(jobs)))]
+    drawn = [0] * len(jobs)
+    for pending in windows:
+        while pending:
+            round_jobs = [dict(jobs[j], _index=j) for j in pending]
+            if dedup is not None:
+                for j in pending:
+                    if dedup.done(jobs[j]):
+                        dedup.stop(jobs[j]["num_samples"] - drawn[j])
+                        p.advance(task, jobs[j]["num_samples"] - drawn[j])
+                        write(j, [], True)
+                pending = [j for j in pending if not dedup.done(jobs[j])]
+                round_jobs = [dict(dedup.next_round(jobs[j], drawn[j]), _index=j) for j in pending]
+
+            for chunk in chunk_jobs(round_jobs, chunk_size):
+                requests = [make_request(job) for job in chunk]
+                n_generated = 0
+                # Samples are written as the backend finishes them, or in job order when scheduled
+                for i, completions in model.codegen_stream(requests, do_sample=do_sample):
+                    job = chunk[i]
+                    assert completions, f"No outputs from model for {job['task_id']} ({job['id_num']})!"
+                    samples = build_samples(job, completions)
+                    j = job["_index"]
+                    write(j, samples, False)
+                    if dedup is not None:
+                        dedup.observe(job, completions)
+                    n_generated += len(samples)
+                    p.advance(task, len(completions))
+                # A request may arrive in several parts, so a job is only complete once its chunk is
+                for job in chunk:
+                    j = job["_index"]
+                    if drawn[j] + job["num_samples"] >= jobs[j]["num_samples"]:
+                        write(j, [], True)
+                p.console.print(f"Generated {n_generated} samples for {len(chunk)} schemas")
+
+            for j, job in zip(pending, round_jobs):
+                drawn[j] += job["num_samples"]
+            pending = [j for j in pending if drawn[j] < jobs[j]["num_samples"]]
+    if own_writers:
+        writers.close()
@@ -0,0 +1,86 @@
+import os
+import atexit
+import hashlib
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+
+class PromptStore:
+    """
+    Rendered and tokenized prompts, stored compactly as one int32 token array with offsets.
+    Entries are keyed by a hash of the render inputs, so that on restart a prompt is
+    neither rendered nor tokenized again.
+    """
+
+    def __init__(self, path: str, save_every: int = 256) -> None:
+        self.path = os.path.expanduser(path)
+        self.save_every = save_every
+        self.index: Dict[str, int] = {}
+        self.text_hashes: List[str] = []
+        self.chunks: List[np.ndarray] = []
+        self.n_unsaved = 0
+        if os.path.exists(self.path):
+            with np.load(self.path) as store:
+                tokens, offsets = store["tokens"], store["offsets"]
+                for i, (key, text_hash) in enumerate(zip(store["keys"], store["text_hashes"])):
+                    self.index[str(key)] = i
+                    self.text_hashes.append(str(text_hash))
+                    self.chunks.append(tokens[offsets[i]:offsets[i + 1]])
+        atexit.register(self.save)
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def compile(
+        self,
+        keys: List[str],
+        render: Callable[[int], str],
+        tokenize: Callable[[List[str]], List[List[int]]],
+    ) -> List[Tuple[np.ndarray, str]]:
+        """
+        Returns (token ids, sha256 of the rendered text) for every key, rendering the
+        i-th prompt with `render(i)` and tokenizing all missing prompts in one call.
+        """
+        missing = {}
+        for i, key in enumerate(keys):
+            if key not in self.index and key not in missing:
+                missing[key] = render(i)
+        if missing:
+            texts = list(missing.values())
+            for key, text, ids in zip(missing, texts, tokenize(texts)):
+                self.index[key] = len(self.chunks)
+                self.chunks.append(np.asarray(ids, dtype=np.int32))
+                self.text_hashes.append(hashlib.sha256(text.encode("utf-8")).hexdigest())
+            self.n_unsaved += len(missing)
+            if self.n_unsaved >= self.save_every or len(missing) > 1:
+                self.save()
+        return [(self.chunks[self.index[key]], self.text_hashes[self.index[key]]) for key in keys]
+
+    def save(self):
+        if not self.n_unsaved:
+            return
+        offsets = np.zeros(len(self.chunks) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(chunk) for chunk in self.chunks])
+        keys = [None] * len(self.index)
+        for key, i in self.index.items():
+            keys[i] = key
+        tmp_path = self.path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            tokens=np.concatenate(self.chunks) if self.chunks else np.zeros(0, dtype=np.int32),
+            offsets=offsets,
+            keys=np.array(keys),
+            text_hashes=np.array(self.text_hashes),
+        )
+        os.replace(tmp_path, self.path)
+        self.n_unsaved = 0
+
+
+def prompt_length_report(lengths: List[int]) -> str:
+    lengths = np.asarray(lengths)
+    p50, p90, p99 = np.percentile(lengths, [50, 90, 99])
+    return (
+        f"{len(lengths)} prompts, {int(lengths.sum())} tokens: "
+        f"min {lengths.min()}, mean {lengths.mean():.0f}, p50 {p50:.0f}, p90 {p90:.0f}, p99 {p99:.0f}, max {lengths.max()}"
+    )
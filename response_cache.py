@@ -0,0 +1,101 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import List, Optional, Tuple
+
+
+class ResponseCache:
+    """
+    On-disk cache of LLM completions keyed by model, rendered prompt, sampling parameters
+    and sample index. Least recently used entries are evicted once `max_bytes` is exceeded.
+    """
+
+    def __init__(self, cache_dir: str = "~/.cache/big-fc", max_bytes: int = 10 * 1024 ** 3) -> None:
+        cache_dir = os.path.expanduser(cache_dir)
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "responses.sqlite")
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, size INTEGER, atime REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_atime ON responses (atime)")
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def prompt_key(
+        model: str, prompt: str, temperature: float, top_p: float, max_tokens: int, prompt_hash: str = None, **extra
+    ) -> str:
+        """
+        Hash of everything but the sample index, so that one prompt is hashed once. Callers that
+        only hold token ids pass the sha256 of the rendered prompt as `prompt_hash` instead.
+        """
+        fields = dict(
+            model=model,
+            prompt=prompt_hash or hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+            temperature=temperature,
+            top_p=top_p,
+            max_tokens=max_tokens,
+            **extra,
+        )
+        return hashlib.sha256(json.dumps(fields, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.conn.execute("UPDATE responses SET atime = ? WHERE key = ?", (time.time(), key))
+                self.conn.commit()
+        return None if row is None else row[0]
+
+    def put(self, key: str, value: str):
+        size = len(key) + len(value.encode("utf-8"))
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, atime) VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time()),
+            )
+            self.conn.commit()
+            self.total_bytes += size
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Drop the least recently used entries until we are 10% below the limit
+        target = int(self.max_bytes * 0.9)
+        rows = self.conn.execute("SELECT key, size FROM responses ORDER BY atime").fetchall()
+        self.total_bytes = sum(size for _, size in rows)
+        evicted = []
+        for key, size in rows:
+            if self.total_bytes <= target:
+                break
+            evicted.append((key,))
+            self.total_bytes -= size
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        self.conn.commit()
+
+    def lookup(self, prompt_key: str, start_index: int, num_samples: int) -> Tuple[List[str], List[str]]:
+        """Returns the cached samples start_index..start_index+num_samples-1 and the keys of the missing ones."""
+        values, missing = [], []
+        for sample_index in range(start_index, start_index + num_samples):
+            key = f"{prompt_key}:{sample_index}"
+            value = self.get(key)
+            if value is None:
+                missing.append(key)
+            else:
+                values.append(value)
+        self.hits += len(values)
+        self.misses += len(missing)
+        return values, missing
+
+    def store(self, keys: List[str], values: List[str]):
+        for key, value in zip(keys, values):
+            self.put(key, value)
@@ -0,0 +1,29 @@
+BS=10
+MODEL=deepseek-ai/DeepSeek-Coder-V2-Lite-Instruct
+BACKEND=vllm
+TEMP=0.8
+TYPE_TEMP=0.2
+N_SAMPLES=10
+NUM_SHARDS=${NUM_SHARDS:-1}
+SHARD_ID=${SHARD_ID:-0}
+NUM_GPU=8
+if [[ $MODEL == *"/"* ]]; then
+  ORG=$(echo $MODEL | cut -d'/' -f1)--
+  BASE_MODEL=$(echo $MODEL | cut -d'/' -f2)
+else
+  ORG=""
+  BASE_MODEL=$MODEL
+fi
+
+python synthesize_all.py \
+    --tp $NUM_GPU \
+    --model $MODEL \
+    --bs $BS \
+    --temperature $TEMP \
+    --type_temperature $TYPE_TEMP \
+    --n_samples $N_SAMPLES \
+    --resume \
+    --backend $BACKEND \
+    --trust_remote_code \
+    --num_shards $NUM_SHARDS \
+    --shard_id $SHARD_ID
\ No newline at end of file
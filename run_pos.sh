@@ -3,6 +3,8 @@ MODEL=deepseek-ai/DeepSeek-Coder-V2-Lite-Instruct
 BACKEND=vllm
 TEMP=0.8
 N_SAMPLES=10
+NUM_SHARDS=${NUM_SHARDS:-1}
+SHARD_ID=${SHARD_ID:-0}
 NUM_GPU=8
 if [[ $MODEL == *"/"* ]]; then
   ORG=$(echo $MODEL | cut -d'/' -f1)--
@@ -20,4 +22,6 @@ python synthesize_fc.py \
     --n_samples $N_SAMPLES \
     --resume \
     --backend $BACKEND \
-    --trust_remote_code
\ No newline at end of file
+    --trust_remote_code \
+    --num_shards $NUM_SHARDS \
+    --shard_id $SHARD_ID
\ No newline at end of file
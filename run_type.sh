@@ -3,6 +3,8 @@ MODEL=meta-llama/Meta-Llama-3.1-70B-Instruct
 BACKEND=vllm
 TEMP=0.2
 N_SAMPLES=10
+NUM_SHARDS=${NUM_SHARDS:-1}
+SHARD_ID=${SHARD_ID:-0}
 NUM_GPU=8
 if [[ $MODEL == *"/"* ]]; then
   ORG=$(echo $MODEL | cut -d'/' -f1)--
@@ -20,4 +22,6 @@ python infer_type.py \
     --n_samples $N_SAMPLES \
     --resume \
     --backend $BACKEND \
-    --trust_remote_code
\ No newline at end of file
+    --trust_remote_code \
+    --num_shards $NUM_SHARDS \
+    --shard_id $SHARD_ID
\ No newline at end of file
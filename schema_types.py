@@ -0,0 +1,107 @@
+import sys
+import argparse
+from collections import Counter
+
+
+class TypeTable:
+    """Interns parameter type names to small integer ids."""
+
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+
+    def intern(self, name):
+        type_id = self.ids.get(name)
+        if type_id is None:
+            type_id = len(self.names)
+            self.names.append(sys.intern(name))
+            self.ids[self.names[type_id]] = type_id
+        return type_id
+
+    def name(self, type_id):
+        return self.names[type_id]
+
+    def __len__(self):
+        return len(self.names)
+
+
+TYPES = TypeTable()
+
+# Raw (lowercased) type names that have a dedicated JSON Schema type; everything else passes through
+JSON_SCHEMA_TYPES = {
+    "none": "null",
+    "true": "boolean",
+    "false": "boolean",
+    "int": "integer",
+}
+
+
+def json_schema_type(type_id):
+    """The single conversion point from an interned type id to its JSON Schema type name."""
+    name = TYPES.name(type_id)
+    return JSON_SCHEMA_TYPES.get(name, name)
+
+
+class Parameter:
+    __slots__ = ("name", "type_ids", "default", "has_default")
+
+    def __init__(self, name, type_ids=(), default=None, has_default=False):
+        self.name = sys.intern(name)
+        self.type_ids = type_ids
+        self.default = default
+        self.has_default = has_default
+
+    @classmethod
+    def from_info(cls, name, param_info):
+        """Build a parameter from the `{"type": [...], "default": ...}` dict produced while parsing a signature."""
+        type_ids = tuple(TYPES.intern(t) for t in param_info.get("type", ()))
+        return cls(name, type_ids, param_info.get("default"), "default" in param_info)
+
+    @property
+    def types(self):
+        return [TYPES.name(type_id) for type_id in self.type_ids]
+
+    def to_schema(self, include_default=True):
+        schema = {}
+        if self.type_ids:
+            types = [json_schema_type(type_id) for type_id in self.type_ids]
+            schema["type"] = types if len(types) > 1 else types[0]
+        if include_default and self.has_default:
+            schema["default"] = self.default
+        return schema
+
+    def __repr__(self):
+        return f"Parameter({self.name!r}, types={self.types!r}, default={self.default!r})"
+
+
+def type_distribution(schemas):
+    """Count parameter types over (task_id, api_name, schema) triples, splitting unions into their members."""
+    counts = Counter()
+    for _, _, data in schemas:
+        for prop in data.get("parameters", {}).get("properties", {}).values():
+            types = prop.get("type")
+            if types is None:
+                counts[TYPES.intern("<untyped>")] += 1
+                continue
+            for t in types if isinstance(types, list) else [types]:
+                counts[TYPES.intern(t)] += 1
+    return counts
+
+
+def main():
+    from diff_schema import iter_schema_store
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("store", nargs="?", default="apis_info_grouped_schema_split.jsonl", type=str)
+    parser.add_argument("--top", default=30, type=int)
+    args = parser.parse_args()
+
+    counts = type_distribution(iter_schema_store(args.store))
+    total = sum(counts.values())
+    print(f"{total} typed parameter slots, {len(counts)} distinct types")
+    for type_id, n in counts.most_common(args.top):
+        print(f"{n:>8} {n / total:>7.2%}  {TYPES.name(type_id)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import os
+import gzip
+import json
+import heapq
+import hashlib
+import argparse
+from typing import Iterator, List, Tuple
+
+from canonical import canonical_json
+
+
+def shard_of(task_id: str, api_name: str, num_shards: int) -> int:
+    """Stable across processes and machines, unlike the builtin `hash`."""
+    digest = hashlib.md5(f"{task_id}\t{api_name}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % num_shards
+
+
+def shard_save_path(save_path: str, shard_id: int, num_shards: int) -> str:
+    # The shard id goes before the whole suffix, e.g. out-shard0of4.jsonl.gz
+    gz = ".gz" if save_path.endswith(".gz") else ""
+    root, ext = os.path.splitext(save_path[:len(save_path) - len(gz)])
+    return f"{root}-shard{shard_id}of{num_shards}{ext}{gz}"
+
+
+def sample_key(sample: dict) -> Tuple[int, str]:
+    return sample["id_num"], sample["task_id"]
+
+
+def _iter_lines(path: str) -> Iterator[Tuple[Tuple[int, str], str]]:
+    with (gzip.open(path, "rt") if path.endswith(".gz") else open(path, "r")) as f:
+        for line in f:
+            if line.strip():
+                yield sample_key(json.loads(line)), line if line.endswith("\n") else line + "\n"
+
+
+def iter_shard(path: str) -> Iterator[Tuple[Tuple[int, str], str]]:
+    """Streams a shard in (id_num, task_id) order, sorting it in memory only if resumes appended out of order."""
+    previous = None
+    for key, _ in _iter_lines(path):
+        if previous is not None and key < previous:
+            # Stable sort keeps the sample order within each (id_num, task_id)
+            yield from sorted(_iter_lines(path), key=lambda item: item[0])
+            return
+        previous = key
+    yield from _iter_lines(path)
+
+
+def merge_shards(paths: List[str], output: str) -> Tuple[int, int]:
+    """K-way merges shard outputs into one file ordered by (id_num, task_id), dropping exact duplicates."""
+    paths = sorted(paths)
+    n_written, n_duplicates = 0, 0
+    current_key, seen = None, set()
+    tmp_path = output + ".tmp"
+    with (gzip.open(tmp_path, "wt") if output.endswith(".gz") else open(tmp_path, "w")) as f:
+        for key, line in heapq.merge(*(iter_shard(path) for path in paths), key=lambda item: item[0]):
+            if key != current_key:
+                current_key, seen = key, set()
+            row = canonical_json(json.loads(line))
+            if row in seen:
+                n_duplicates += 1
+                continue
+            seen.add(row)
+            f.write(line)
+            n_written += 1
+    os.replace(tmp_path, output)
+    return n_written, n_duplicates
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("shards", nargs="+", type=str)
+    parser.add_argument("--output", required=True, type=str)
+    args = parser.parse_args()
+
+    n_written, n_duplicates = merge_shards(args.shards, args.output)
+    print(f"Merged {len(args.shards)} shards into {args.output}: {n_written} samples, {n_duplicates} duplicates dropped")
+
+
+if __name__ == "__main__":
+    main()
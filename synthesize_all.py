@@ -0,0 +1,260 @@
+import os
+import argparse
+
+from model import DecoderBase, make_model
+from rich.progress import (
+    BarColumn,
+    MofNCompleteColumn,
+    Progress,
+    TextColumn,
+    TimeElapsedColumn,
+)
+from utils import load_api_schema, load_example, load_resume_index, save_resume_index
+from merge_schema import load_union_schema
+from diff_schema import load_regeneration_list, drop_regenerated_rows
+from pipeline import run_batched
+from response_cache import ResponseCache
+from prompt_store import PromptStore
+from shards import shard_of, shard_save_path
+from writer import WriterPool
+from example_window import ExampleWindower
+from telemetry import Telemetry
+from dedup import OnlineDedup
+
+# Output prefix of each template, as written by synthesize_fc.py and infer_type.py
+SAVE_PREFIXES = {
+    "positive": "positive--",
+    "negative": "negative--",
+    "type": "typeinfer--",
+}
+
+
+def codegen(
+    model: DecoderBase,
+    save_paths: dict,
+    temperatures: dict = None,
+    greedy=False,
+    n_samples=1,
+    id_range=None,
+    resume=True,
+    union_path=None,
+    only=None,
+    chunk_size=1024,
+    num_shards=1,
+    shard_id=0,
+    fsync=False,
+    example_budget=None,
+    unique_k=None,
+    max_dup_rate=None,
+    dedup_round=2,
+    schedule=False,
+):
+    """
+    Runs the jobs of every template in `save_paths` against one model. The jobs of a schema
+    are queued next to each other, so that all templates share the same batches.
+    """
+    with Progress(
+        TextColumn(f"Synthesize {', '.join(save_paths)} •" + "[progress.percentage]{task.percentage:>3.0f}%"),
+        BarColumn(),
+        MofNCompleteColumn(),
+        TextColumn("•"),
+        TimeElapsedColumn(),
+    ) as p, WriterPool(fsync=fsync) as writers:
+
+        for save_path in save_paths.values():
+            dirname = os.path.dirname(save_path)
+            if not os.path.exists(dirname) and dirname != "":
+                os.makedirs(dirname)
+
+        api_schemas = load_api_schema() if union_path is None else load_union_schema(union_path)
+        data = load_example()
+        # Only the code around the uses of each API goes into its prompt
+        windower = ExampleWindower(example_budget) if example_budget else None
+        # The samples of the pairs listed by --only are for their old schemas
+        if only is not None:
+            for save_path in save_paths.values():
+                p.console.print(f"Dropped {drop_regenerated_rows(save_path, only)} samples to regenerate from {save_path}")
+        existing = {template: load_resume_index(save_path) if resume else None for template, save_path in save_paths.items()}
+        # Stop sampling an API early once its samples stop being new
+        dedup = OnlineDedup(unique_k, max_dup_rate, dedup_round) if unique_k or max_dup_rate else None
+        if dedup is not None and resume:
+            for template, save_path in save_paths.items():
+                dedup.load(save_path, template)
+        jobs = []
+        for id_num, schema in enumerate(p.track(api_schemas)):
+            id_num = schema.get("id_num", id_num)
+            task_id = schema["task_id"]
+            api = schema["data"]
+            if id_range is not None:
+                low, high = id_range
+                if id_num < low or id_num >= high:
+                    continue
+            if num_shards > 1 and shard_of(task_id, api["name"], num_shards) != shard_id:
+                continue
+            sites = schema.get("sites", [dict(id_num=id_num, task_id=task_id)])
+            if only is not None and not any((site["task_id"], api["name"]) in only for site in sites):
+                continue
+
+            example = data[task_id]
+            if windower is not None:
+                example = windower(task_id, example, api["name"])
+            for template, save_path in save_paths.items():
+                job_api = api
+                if template == "type":
+                    # Type inference skips classes and does not show the API type
+                    if api.get("type") == "class":
+                        continue
+                    job_api = {k: v for k, v in api.items() if k != "type"}
+
+                n_existing = existing[template][(task_id, id_num)] if resume else 0
+                nsamples = n_samples - n_existing
+                if nsamples <= 0:
+                    continue
+                job = dict(
+                    id_num=id_num,
+                    task_id=task_id,
+                    api=job_api,
+                    example=example,
+                    sites=sites,
+                    num_samples=nsamples,
+                    start_index=n_existing,
+                    template=template,
+                    save_path=save_path,
+                    existing=existing[template],
+                )
+                if temperatures is not None:
+                    job["temperature"] = temperatures[template]
+                if "union_id" in schema:
+                    job["union_id"] = schema["union_id"]
+                jobs.append(job)
+
+        if jobs:
+            run_batched(p, model, jobs, None, do_sample=not greedy, chunk_size=chunk_size, writers=writers, dedup=dedup, schedule=schedule)
+
+        # The resume index records the file size, so the samples must be on disk first
+        writers.close()
+        if resume:
+            for template, save_path in save_paths.items():
+                save_resume_index(save_path, existing[template])
+
+        if windower is not None:
+            p.console.print(windower.report())
+        if dedup is not None:
+            p.console.print(dedup.report(model.stats.get("completion_tokens")))
+        if model.summary():
+            p.console.print(f"Run summary @ {model}: {model.summary()}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", required=True, type=str)
+    parser.add_argument("--templates", nargs="+", default=list(SAVE_PREFIXES), choices=list(SAVE_PREFIXES))
+    parser.add_argument("--save_dir", default="", type=str)
+    parser.add_argument("--bs", default=1, type=int)
+    parser.add_argument("--n_samples", default=1, type=int)
+    parser.add_argument("--temperature", default=0.0, type=float)
+    parser.add_argument("--type_temperature", default=None, type=float, help="Temperature of the type inference jobs")
+    parser.add_argument("--greedy", action="store_true")
+    parser.add_argument("--resume", action="store_true")
+    parser.add_argument("--id_range", nargs=2, type=int)
+    parser.add_argument("--num_shards", default=1, type=int)
+    parser.add_argument("--shard_id", default=0, type=int)
+    parser.add_argument("--union_path", default=None, type=str)
+    parser.add_argument("--only", default=None, type=str, help="Regeneration list written by diff_schema.py; the existing samples of its pairs are dropped first")
+    parser.add_argument("--chunk_size", default=1024, type=int, help="Sequences per batched generate call")
+    parser.add_argument("--backend", default="vllm", type=str, choices=["vllm", "openai", "fake"])
+    parser.add_argument("--base_url", default=None, type=str, nargs="+", help="One or more OpenAI-compatible endpoints to balance across")
+    parser.add_argument("--concurrency", default=1, type=int, help="In-flight requests for --backend openai")
+    parser.add_argument("--max_concurrency", default=None, type=int, help="Adapt the in-flight requests between 1 and this, starting at --concurrency")
+    parser.add_argument("--tp", default=1, type=int)
+    parser.add_argument("--trust_remote_code", action="store_true")
+    parser.add_argument("--tokenizer_legacy", action="store_true")
+    parser.add_argument("--tokenizer_name", default=None, type=str)
+    parser.add_argument("--enable_prefix_caching", action="store_true")
+    parser.add_argument("--cache_dir", default=None, type=str, help="Reuse completions cached on disk, e.g. ~/.cache/big-fc")
+    parser.add_argument("--cache_max_gb", default=10, type=float)
+    parser.add_argument("--example_budget", default=None, type=int, help="Window each example to about this many tokens")
+    parser.add_argument("--unique_k", default=None, type=int, help="Stop sampling an API once it has this many distinct valid samples")
+    parser.add_argument("--max_dup_rate", default=None, type=float, help="Stop sampling an API once this fraction of its valid samples are duplicates")
+    parser.add_argument("--dedup_round", default=2, type=int, help="Samples drawn per API between two dedup checks")
+    parser.add_argument("--schedule", action="store_true", help="Submit prompts grouped by example and sorted by length; the output keeps id_num order")
+    parser.add_argument("--fsync", action="store_true", help="fsync the output after every flush")
+    parser.add_argument("--metrics_path", default=None, type=str, help="Per-request latency and token metrics (JSONL)")
+    parser.add_argument("--prom_path", default=None, type=str, help="Prometheus textfile with the aggregated metrics")
+    parser.add_argument("--prompt_store", default=None, type=str, help="Reuse rendered and tokenized prompts (vllm only), e.g. prompts.npz")
+
+    args = parser.parse_args()
+
+    if args.greedy or (args.temperature == 0 and args.n_samples == 1):
+        args.temperature = 0
+        args.type_temperature = None
+        args.bs = 1
+        args.n_samples = 1
+        args.greedy = True
+        print("Greedy decoding ON (--greedy): setting bs=1, n_samples=1, temperature=0")
+
+    if args.id_range is not None:
+        assert len(args.id_range) == 2, "id_range must be a list of length 2"
+        assert args.id_range[0] < args.id_range[1], "id_range must be increasing"
+        args.id_range = tuple(args.id_range)
+
+    assert 0 <= args.shard_id < args.num_shards, "shard_id must be in [0, num_shards)"
+
+    # The model is loaded once and serves the jobs of every template
+    model_runner = make_model(
+        model=args.model,
+        backend=args.backend,
+        batch_size=args.bs,
+        temperature=args.temperature,
+        base_url=args.base_url,
+        tp=args.tp,
+        trust_remote_code=args.trust_remote_code,
+        tokenizer_name=args.tokenizer_name,
+        tokenizer_legacy=args.tokenizer_legacy,
+        enable_prefix_caching=args.enable_prefix_caching,
+        concurrency=args.concurrency,
+        max_concurrency=args.max_concurrency,
+    )
+    if args.cache_dir:
+        model_runner.cache = ResponseCache(args.cache_dir, max_bytes=int(args.cache_max_gb * 1024 ** 3))
+    if args.prompt_store:
+        model_runner.prompt_store = PromptStore(args.prompt_store)
+    if args.metrics_path or args.prom_path:
+        model_runner.telemetry = Telemetry(args.metrics_path, args.prom_path)
+
+    temperatures = {template: args.temperature for template in args.templates}
+    if args.type_temperature is not None and "type" in temperatures:
+        temperatures["type"] = args.type_temperature
+
+    save_paths = {}
+    for template in args.templates:
+        save_path = SAVE_PREFIXES[template] + args.model.replace("/", "--") + f"--{args.backend}-{temperatures[template]}-{args.n_samples}.jsonl"
+        save_path = os.path.join(args.save_dir, save_path)
+        if args.num_shards > 1:
+            save_path = shard_save_path(save_path, args.shard_id, args.num_shards)
+        save_paths[template] = save_path
+
+    codegen(
+        model=model_runner,
+        save_paths=save_paths,
+        temperatures=temperatures,
+        greedy=args.greedy,
+        n_samples=args.n_samples,
+        resume=args.resume,
+        id_range=args.id_range,
+        union_path=args.union_path,
+        only=load_regeneration_list(args.only) if args.only else None,
+        chunk_size=args.chunk_size,
+        num_shards=args.num_shards,
+        shard_id=args.shard_id,
+        fsync=args.fsync,
+        example_budget=args.example_budget,
+        unique_k=args.unique_k,
+        max_dup_rate=args.max_dup_rate,
+        dedup_round=args.dedup_round,
+        schedule=args.schedule,
+    )
+
+
+if __name__ == "__main__":
+    main()
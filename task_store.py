@@ -0,0 +1,112 @@
+import os
+import json
+import mmap
+import argparse
+from typing import Dict, Iterable, Iterator
+
+TASK_STORE_PATH = "bigcodebench-hard.tasks.jsonl"
+DATASET = "bigcode/bigcodebench-hard"
+SPLIT = "v0.1.0_hf"
+
+
+def _index_path(path: str) -> str:
+    return path + ".idx.json"
+
+
+def build_task_store(records: Iterable[Dict], path: str = TASK_STORE_PATH) -> int:
+    """Writes one task per line plus an index of {task_id: [offset, length]} into the file."""
+    index = {}
+    offset = 0
+    with open(path + ".tmp", "wb") as f:
+        for record in records:
+            line = (json.dumps(dict(record)) + "\n").encode("utf-8")
+            index[record["task_id"]] = [offset, len(line)]
+            f.write(line)
+            offset += len(line)
+    with open(_index_path(path) + ".tmp", "w") as f:
+        json.dump({"size": offset, "tasks": index}, f)
+    # Data last: if the build stops in between, the old data no longer matches the new index
+    os.replace(_index_path(path) + ".tmp", _index_path(path))
+    os.replace(path + ".tmp", path)
+    return len(index)
+
+
+def is_valid_store(path: str = TASK_STORE_PATH) -> bool:
+    """Whether the data file and its index exist and match, e.g. not after a build that was interrupted."""
+    try:
+        with open(_index_path(path), "r") as f:
+            index = json.load(f)
+        return os.path.getsize(path) == index["size"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return False
+
+
+def load_dataset_records(dataset: str = DATASET, split: str = SPLIT) -> Iterator[Dict]:
+    # Only building the store needs the datasets package and the network
+    from datasets import load_dataset
+
+    yield from load_dataset(dataset, split=split)
+
+
+def load_jsonl_records(filename: str) -> Iterator[Dict]:
+    with open(filename, "r") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class TaskStore:
+    """
+    Read-only mapping of task_id to example code (code_prompt + canonical_solution). The data
+    file is memory-mapped and a task is only decoded when it is looked up.
+    """
+
+    def __init__(self, path: str = TASK_STORE_PATH) -> None:
+        self.path = path
+        with open(_index_path(path), "r") as f:
+            index = json.load(f)
+        self.index = index["tasks"]
+        self.fp = open(path, "rb")
+        size = os.fstat(self.fp.fileno()).st_size
+        assert size == index["size"], f"{path} does not match its index, rebuild it with task_store.py"
+        self.data = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def record(self, task_id: str) -> Dict:
+        offset, length = self.index[task_id]
+        return json.loads(self.data[offset:offset + length])
+
+    def __getitem__(self, task_id: str) -> str:
+        record = self.record(task_id)
+        return record["code_prompt"] + record["canonical_solution"]
+
+    def get(self, task_id: str, default=None):
+        return self[task_id] if task_id in self.index else default
+
+    def __contains__(self, task_id: str) -> bool:
+        return task_id in self.index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.index)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def keys(self):
+        return self.index.keys()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", default=TASK_STORE_PATH, type=str)
+    parser.add_argument("--jsonl", default=None, type=str, help="Build from a local dump such as hard.jsonl")
+    parser.add_argument("--dataset", default=DATASET, type=str)
+    parser.add_argument("--split", default=SPLIT, type=str)
+    args = parser.parse_args()
+
+    records = load_jsonl_records(args.jsonl) if args.jsonl else load_dataset_records(args.dataset, args.split)
+    n_tasks = build_task_store(records, args.path)
+    print(f"Stored {n_tasks} tasks in {args.path}")
+
+
+if __name__ == "__main__":
+    main()
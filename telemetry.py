@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import atexit
+import argparse
+import threading
+from collections import defaultdict
+from typing import List, Optional
+
+from writer import JsonlWriter
+
+# Upper bounds in seconds of the Prometheus latency histogram
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250]
+# HELP text of the counter families; gauges are named after the controller state they expose
+COUNTERS = {
+    "bigfc_requests_total": "Decoder requests that completed.",
+    "bigfc_samples_total": "Samples generated.",
+    "bigfc_prompt_tokens_total": "Prompt tokens sent.",
+    "bigfc_completion_tokens_total": "Completion tokens generated.",
+}
+
+
+class Telemetry:
+    """
+    Per-request decoder metrics: queue, prefill and decode time, token counts and tokens/s.
+    Requests go to a JSONL file and, if `prom_path` is set, are aggregated into a Prometheus
+    textfile that is rewritten at most every `prom_interval` seconds and on close.
+    """
+
+    def __init__(self, path: str = None, prom_path: str = None, prom_interval: float = 15.0) -> None:
+        self.writer = JsonlWriter(path) if path else None
+        self.prom_path = prom_path
+        self.prom_interval = prom_interval
+        self.prom_written = 0.0
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.gauges = {}
+        self.buckets = defaultdict(lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+        self.latency_sums = defaultdict(float)
+        atexit.register(self.close)
+
+    def record(
+        self,
+        model: str,
+        template: Optional[str],
+        num_samples: int,
+        prompt_tokens: int,
+        completion_tokens: int,
+        start: float,
+        end: float,
+        queue_s: float = None,
+        prefill_s: float = None,
+        decode_s: float = None,
+        **extra,
+    ):
+        latency = end - start
+        busy = prefill_s + decode_s if prefill_s is not None and decode_s is not None else latency - (queue_s or 0)
+        row = dict(
+            model=model,
+            template=template,
+            num_samples=num_samples,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            start=start,
+            end=end,
+            latency_s=latency,
+            queue_s=queue_s,
+            prefill_s=prefill_s,
+            decode_s=decode_s,
+            tok_per_s=completion_tokens / busy if busy > 0 else None,
+            **extra,
+        )
+        if self.writer is not None:
+            self.writer.write([row])
+        if self.prom_path:
+            with self.lock:
+                labels = f'template="{template}"'
+                self.counters[f"bigfc_requests_total{{{labels}}}"] += 1
+                self.counters[f"bigfc_samples_total{{{labels}}}"] += num_samples
+                self.counters[f"bigfc_prompt_tokens_total{{{labels}}}"] += prompt_tokens
+                self.counters[f"bigfc_completion_tokens_total{{{labels}}}"] += completion_tokens
+                self.latency_sums[labels] += latency
+                buckets = self.buckets[labels]
+                buckets[sum(latency > bound for bound in LATENCY_BUCKETS)] += 1
+            if time.time() - self.prom_written >= self.prom_interval:
+                self.write_prometheus()
+
+    def set_gauges(self, values: dict):
+        """Current values of controller state, such as the adaptive concurrency limit."""
+        with self.lock:
+            self.gauges.update(values)
+
+    def write_prometheus(self):
+        with self.lock:
+            lines = []
+            for name, text in COUNTERS.items():
+                lines += [f"# HELP {name} {text}", f"# TYPE {name} counter"]
+                for key, value in sorted(self.counters.items()):
+                    if key.split("{")[0] == name:
+                        lines.append(f"{key} {value:g}")
+            for key, value in sorted(self.gauges.items()):
+                lines += [f"# HELP bigfc_{key} Controller state {key}.", f"# TYPE bigfc_{key} gauge", f"bigfc_{key} {value:g}"]
+            lines += [
+                "# HELP bigfc_request_latency_seconds Latency of the decoder requests.",
+                "# TYPE bigfc_request_latency_seconds histogram",
+            ]
+            for labels, counts in sorted(self.buckets.items()):
+                total = 0
+                for bound, count in zip(LATENCY_BUCKETS + ["+Inf"], counts):
+                    total += count
+                    lines.append(f'bigfc_request_latency_seconds_bucket{{{labels},le="{bound}"}} {total}')
+                lines.append(f"bigfc_request_latency_seconds_sum{{{labels}}} {self.latency_sums[labels]:g}")
+                lines.append(f"bigfc_request_latency_seconds_count{{{labels}}} {total}")
+            self.prom_written = time.time()
+        # node_exporter may read the file at any time, so replace it atomically
+        with open(self.prom_path + ".tmp", "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(self.prom_path + ".tmp", self.prom_path)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self.prom_path:
+            self.write_prometheus()
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+def summarize(path: str) -> str:
+    groups = defaultdict(list)
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                groups[row["template"]].append(row)
+
+    lines = []
+    for template, rows in sorted(groups.items(), key=lambda item: str(item[0])):
+        span = max(row["end"] for row in rows) - min(row["start"] for row in rows)
+        n_completion = sum(row["completion_tokens"] for row in rows)
+        n_samples = sum(row["num_samples"] for row in rows)
+        lines.append(
+            f"{template}: {len(rows)} requests, {n_samples} samples, "
+            f"{sum(row['prompt_tokens'] for row in rows)} prompt / {n_completion} completion tokens, "
+            f"{n_completion / span if span > 0 else 0:.1f} tok/s, {n_samples / span if span > 0 else 0:.2f} samples/s"
+        )
+        for field in ("latency_s", "queue_s", "prefill_s", "decode_s", "tok_per_s"):
+            values = [row[field] for row in rows if row.get(field) is not None]
+            if values:
+                lines.append(
+                    f"  {field:<10} p50 {percentile(values, 50):9.3f}  p95 {percentile(values, 95):9.3f}  "
+                    f"p99 {percentile(values, 99):9.3f}"
+                )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("metrics_path", type=str, help="JSONL written with --metrics_path")
+    args = parser.parse_args()
+    print(summarize(args.metrics_path))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 import re
 import json
 
+from schema_types import Parameter
+
 def parse_api_info(api_info):
     if api_info['type'] == 'constant':
         return create_constant_schema(api_info)
@@ -84,7 +86,7 @@ def parse_signature(signature):
         #     if "type" not in param_info or param_info["type"] == ["object"]:
         #         param_info["type"] = [type(parsed_default).__name__]
         
-        parameters[name] = param_info
+        parameters[name] = Parameter.from_info(name, param_info)
     return parameters
 
 def parse_type_annotation(annotation):
@@ -125,31 +127,8 @@ def create_parameter_schema(parsed_signature):
         "properties": {}
     }
     
-    for param_name, param_info in parsed_signature.items():
-        param_schema = {}
-        if "type" in param_info:
-            types = param_info["type"]
-            if isinstance(types, list):
-                cleaned_types = []
-                for t in types:
-                    if t == "none":
-                        cleaned_types.append("null")
-                    elif t in ["true", "false"]:
-                        cleaned_types.append("boolean")
-                    elif t == "int":
-                        cleaned_types.append("integer")
-                    else:
-                        cleaned_types.append(t)
-                param_schema["type"] = cleaned_types if len(cleaned_types) > 1 else cleaned_types[0]
-            else:
-                if types == "none":
-                    param_schema["type"] = "null"
-                elif types in ["true", "false"]:
-                    param_schema["type"] = "boolean"
-                elif types == "int":
-                    param_schema["type"] = "integer"
-                else:
-                    param_schema["type"] = types
+    for param_name, param in parsed_signature.items():
+        param_schema = param.to_schema(include_default=False)
         
         # if "default" in param_info:
         #     default = param_info["default"]
@@ -0,0 +1,42 @@
+from dedup import OnlineDedup, normalize_synthesis
+
+# Type completions as the model returns them, continuing the prefilled start of the JSON object
+TYPE_NONE = 'The function writes the word counts to a file in JSON format, so the return type should be None.", "return_type": "None"}\n```'
+TYPE_LIST = 'The function `task_func` creates histograms for each numeric column in a DataFrame and returns the axes objects for further customization.", "return_type": "list"}\n```'
+TYPE_STR = 'The API call \'LoginForm().username\' refers to the username field of a login form. Since this is a form field, it should return a string value.", "return_type": "str"}\n```'
+
+JOB = dict(template="type", task_id="BigCodeBench/1", id_num=0)
+
+
+def test_type_completions_are_valid():
+    for completion in (TYPE_NONE, TYPE_LIST, TYPE_STR):
+        assert normalize_synthesis(completion)[1]
+    assert normalize_synthesis(TYPE_NONE)[0] == normalize_synthesis(TYPE_NONE.replace('", "', '",\n  "'))[0]
+    assert normalize_synthesis(TYPE_NONE)[0] != normalize_synthesis(TYPE_LIST)[0]
+
+
+def test_schema_completions_are_valid():
+    key, valid = normalize_synthesis('```json\n{"name": "inverse_matrix", "type": "function"}\n```')
+    assert valid and key == normalize_synthesis('{"type": "function",\n "name": "inverse_matrix"}')[0]
+    assert not normalize_synthesis('{"type": "function"}')[1]
+
+
+def test_unique_k_counts_distinct_type_completions():
+    dedup = OnlineDedup(unique_k=3)
+    dedup.observe(JOB, [TYPE_NONE, TYPE_NONE, TYPE_LIST])
+    assert not dedup.done(JOB)
+    dedup.observe(JOB, [TYPE_STR])
+    assert dedup.done(JOB)
+
+
+def test_dup_rate_counts_every_sample():
+    dedup = OnlineDedup(max_dup_rate=0.5)
+    # Completions that do not parse still count as duplicates of each other
+    dedup.observe(JOB, ["", "", "not json", "not  json"])
+    assert dedup.done(JOB)
+
+    dedup = OnlineDedup(max_dup_rate=0.5)
+    dedup.observe(JOB, [TYPE_NONE, TYPE_LIST])
+    assert not dedup.done(JOB)
+    dedup.observe(JOB, [TYPE_NONE, TYPE_LIST])
+    assert dedup.done(JOB)
@@ -0,0 +1,24 @@
+import gzip
+import json
+
+from diff_schema import drop_regenerated_rows
+from utils import load_resume_index, save_resume_index, write_jsonl
+
+
+def test_drop_regenerated_rows(tmp_path):
+    rows = [
+        dict(id_num=id_num, task_id="BigCodeBench/1", api_name=name, synthesis=str(k))
+        for id_num, name in enumerate(["os.path.join", "json.loads"])
+        for k in range(2)
+    ]
+    path = str(tmp_path / "out.jsonl")
+    write_jsonl(path, rows)
+    save_resume_index(path, load_resume_index(path))
+    assert drop_regenerated_rows(path, {("BigCodeBench/1", "json.loads")}) == 2
+    assert load_resume_index(path) == {("BigCodeBench/1", 0): 2}
+
+    gz_path = str(tmp_path / "out.jsonl.gz")
+    write_jsonl(gz_path, rows)
+    assert drop_regenerated_rows(gz_path, {("BigCodeBench/1", "os.path.join")}) == 2
+    with gzip.open(gz_path, "rt") as f:
+        assert [json.loads(line)["api_name"] for line in f] == ["json.loads"] * 2
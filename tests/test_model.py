@@ -0,0 +1,10 @@
+from model import FakeDecoder
+from openai_request import RetryPolicy
+
+
+def test_fake_failures_are_retried():
+    model = FakeDecoder("fake", batch_size=2, fail_rate=0.5, retry=RetryPolicy(base_delay=0))
+    requests = [dict(api=dict(name=f"api{k}"), example="", num_samples=2, start_index=0) for k in range(20)]
+    outputs = [model.codegen_batch([request])[0] for request in requests]
+    assert all(len(samples) == 2 for samples in outputs)
+    assert model.retry.stats["timeouts"] == model.stats["failures"] > 0
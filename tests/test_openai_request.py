@@ -0,0 +1,38 @@
+import time
+
+import pytest
+
+from openai_request import RetryPolicy, stream_async_requests
+
+
+def test_breaker_ignores_errors_that_are_not_retried():
+    policy = RetryPolicy(breaker_threshold=3, base_delay=0)
+    started = time.time()
+    for _ in range(5):
+        with pytest.raises(ValueError):
+            policy.failure(ValueError("bad request"), 1, started)
+    assert policy.failures == 0 and policy.admit(started) == 0
+
+    for attempt in range(1, 4):
+        policy.failure(TimeoutError(), attempt, started)
+    assert policy.stats["breaker_opened"] == 1 and policy.admit(started) > 0
+
+
+class FailingClient:
+    """Answers with the prompt, except that it rejects the prompts containing "bad"."""
+
+    def __init__(self):
+        self.chat = self
+        self.completions = self
+
+    async def create(self, messages, **kwargs):
+        prompt = messages[-1]["content"]
+        if "bad" in prompt:
+            raise ValueError(prompt)
+        return prompt
+
+
+def test_stream_skips_failed_requests():
+    payloads = [dict(message=message, model="m") for message in ("one", "bad", "three")]
+    results = stream_async_requests(lambda base_url: FailingClient(), payloads, policy=RetryPolicy(base_delay=0))
+    assert sorted((i, ret) for i, ret, _ in results) == [(0, "one"), (2, "three")]
@@ -0,0 +1,101 @@
+import json
+
+from pipeline import ReorderBuffer, run_batched
+
+
+class Console:
+    def print(self, *args, **kwargs):
+        pass
+
+
+class Progress:
+    console = Console()
+
+    def add_task(self, *args, **kwargs):
+        return 0
+
+    def advance(self, *args, **kwargs):
+        pass
+
+
+class TwoPartModel:
+    """Streams each request in two parts, last request first, like a cached part then an API call."""
+
+    def compile_prompts(self, requests):
+        return None
+
+    def codegen_stream(self, requests, do_sample=True):
+        for part in range(2):
+            for i in reversed(range(len(requests))):
+                request = requests[i]
+                start = request["start_index"]
+                indices = range(start, start + request["num_samples"])[part::2]
+                yield i, [f"{request['api']['name']}-{k}" for k in indices]
+
+
+def make_jobs(n_jobs, num_samples):
+    return [
+        dict(
+            id_num=id_num,
+            task_id=f"BigCodeBench/{id_num}",
+            api=dict(name=f"api{id_num}"),
+            example="x = 1\n" * (n_jobs - id_num),
+            num_samples=num_samples,
+            start_index=0,
+            template="positive",
+        )
+        for id_num in range(n_jobs)
+    ]
+
+
+def read_rows(path):
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_reorder_buffer_releases_in_job_order():
+    buffer = ReorderBuffer(3)
+    assert buffer.add(2, ["c"], True) == []
+    assert buffer.add(0, ["a1"], False) == []
+    assert buffer.add(1, ["b"], True) == []
+    assert buffer.add(0, ["a2"], True) == [(0, ["a1", "a2"]), (1, ["b"]), (2, ["c"])]
+
+
+def test_schedule_keeps_every_part_of_a_job(tmp_path):
+    unscheduled, scheduled = tmp_path / "unscheduled.jsonl", tmp_path / "scheduled.jsonl"
+    run_batched(Progress(), TwoPartModel(), make_jobs(3, 4), str(unscheduled), chunk_size=2)
+    run_batched(Progress(), TwoPartModel(), make_jobs(3, 4), str(scheduled), chunk_size=2, schedule=True)
+
+    rows = read_rows(scheduled)
+    assert len(rows) == len(read_rows(unscheduled)) == 12
+    assert [(row["id_num"], row["synthesis"]) for row in rows] == [
+        (id_num, f"api{id_num}-{k}") for id_num in range(3) for k in (0, 2, 1, 3)
+    ]
+
+
+class RecordingWriters:
+    """Records how many requests the model had been sent when each write happened."""
+
+    def __init__(self, model):
+        self.model = model
+        self.writes = []
+
+    def write(self, filename, samples):
+        self.writes.append((self.model.n_requests, len(samples)))
+
+
+class CountingModel(TwoPartModel):
+    n_requests = 0
+
+    def codegen_stream(self, requests, do_sample=True):
+        self.n_requests += len(requests)
+        yield from super().codegen_stream(requests, do_sample)
+
+
+def test_schedule_writes_before_the_run_ends():
+    model = CountingModel()
+    writers = RecordingWriters(model)
+    # Longer examples go last, so job 0 is the last job of each window
+    run_batched(Progress(), model, make_jobs(6, 2), "out.jsonl", chunk_size=2, writers=writers, schedule=True, schedule_window=2)
+    assert sum(n for _, n in writers.writes) == 12
+    assert writers.writes[0][0] < model.n_requests
@@ -0,0 +1,24 @@
+import gzip
+import json
+
+from shards import merge_shards, shard_save_path
+
+
+def test_shard_save_path_keeps_the_whole_suffix():
+    assert shard_save_path("out/typeinfer-0.2-10.jsonl", 1, 4) == "out/typeinfer-0.2-10-shard1of4.jsonl"
+    assert shard_save_path("out/typeinfer-0.2-10.jsonl.gz", 1, 4) == "out/typeinfer-0.2-10-shard1of4.jsonl.gz"
+
+
+def test_merge_gzip_shards(tmp_path):
+    rows = [dict(id_num=id_num, task_id=f"BigCodeBench/{id_num}", synthesis=str(id_num)) for id_num in range(4)]
+    paths = [shard_save_path(str(tmp_path / "out.jsonl.gz"), shard_id, 2) for shard_id in range(2)]
+    for shard_id, path in enumerate(paths):
+        with gzip.open(path, "wt") as f:
+            # The second shard was appended to out of order by a resume
+            for row in rows[shard_id::2][::-1 if shard_id else 1] + rows[shard_id:shard_id + 1]:
+                f.write(json.dumps(row) + "\n")
+
+    output = str(tmp_path / "out.jsonl.gz")
+    assert merge_shards(paths, output) == (4, 2)
+    with gzip.open(output, "rt") as f:
+        assert [json.loads(line) for line in f] == rows
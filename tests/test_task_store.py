@@ -0,0 +1,28 @@
+import os
+
+from task_store import TaskStore, build_task_store, is_valid_store
+
+RECORDS = [
+    dict(task_id="BigCodeBench/1", code_prompt="def task_func():\n", canonical_solution="    return 1\n"),
+    dict(task_id="BigCodeBench/2", code_prompt="def task_func(x):\n", canonical_solution="    return x\n"),
+]
+
+
+def test_store_round_trip(tmp_path):
+    path = str(tmp_path / "hard.tasks.jsonl")
+    assert not is_valid_store(path)
+    assert build_task_store(RECORDS, path) == 2
+    assert is_valid_store(path)
+    store = TaskStore(path)
+    assert store["BigCodeBench/2"] == "def task_func(x):\n    return x\n"
+
+
+def test_interrupted_build_is_invalid(tmp_path):
+    path = str(tmp_path / "hard.tasks.jsonl")
+    build_task_store(RECORDS[:1], path)
+    # A build that stopped after the new index was in place, before the data file
+    build_task_store(RECORDS, path + ".next")
+    os.replace(path + ".next.idx.json", path + ".idx.json")
+    assert not is_valid_store(path)
+    os.remove(path + ".idx.json")
+    assert not is_valid_store(path)
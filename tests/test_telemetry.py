@@ -0,0 +1,24 @@
+from telemetry import Telemetry
+
+
+def test_prometheus_families_are_typed(tmp_path):
+    prom_path = str(tmp_path / "bigfc.prom")
+    telemetry = Telemetry(prom_path=prom_path, prom_interval=3600)
+    telemetry.record("fake", "positive", 2, 100, 128, start=0.0, end=0.3)
+    telemetry.set_gauges(dict(concurrency_limit=8))
+    telemetry.close()
+
+    with open(prom_path, "r") as f:
+        lines = f.read().splitlines()
+    assert "# TYPE bigfc_requests_total counter" in lines
+    assert "# TYPE bigfc_concurrency_limit gauge" in lines
+    assert "# TYPE bigfc_request_latency_seconds histogram" in lines
+    assert 'bigfc_request_latency_seconds_bucket{template="positive",le="0.5"} 1' in lines
+    assert 'bigfc_request_latency_seconds_sum{template="positive"} 0.3' in lines
+    # Every sample line belongs to the family declared last
+    family = None
+    for line in lines:
+        if line.startswith("# TYPE"):
+            family = line.split()[2]
+        elif not line.startswith("#"):
+            assert line.startswith(family)
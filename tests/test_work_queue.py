@@ -0,0 +1,82 @@
+import json
+
+from work_queue import WorkQueue, run_queue
+
+
+class Console:
+    def print(self, *args, **kwargs):
+        pass
+
+
+class Progress:
+    console = Console()
+
+
+class EchoModel:
+    def codegen_batch(self, requests, do_sample=True):
+        return [[f"{request['api']['name']}-{request['start_index'] + k}" for k in range(request["num_samples"])] for request in requests]
+
+
+def make_jobs(n):
+    return [
+        dict(id_num=id_num, task_id=f"BigCodeBench/{id_num}", api=dict(name=f"api{id_num}"), example="", num_samples=2, start_index=0, template="positive")
+        for id_num in range(n)
+    ]
+
+
+def read(path):
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_worker_takes_over_the_items_of_a_dead_worker(tmp_path):
+    queue_path, save_path = str(tmp_path / "queue.db"), str(tmp_path / "out.jsonl")
+    dead = WorkQueue(queue_path, lease_s=0.5)
+    dead.add(make_jobs(4), save_path)
+    assert len(dead.lease("dead", 2)) == 2
+
+    stats = run_queue(Progress(), EchoModel(), make_jobs(4), queue_path, save_path, lease_size=1, lease_s=0.5, poll_s=0.1)
+    assert stats["completed"] == 4
+    assert [row["id_num"] for row in read(save_path)] == [0, 0, 1, 1, 2, 2, 3, 3]
+
+
+def test_failed_and_resumed_jobs_are_queued_again(tmp_path):
+    queue_path, save_path = str(tmp_path / "queue.db"), str(tmp_path / "out.jsonl")
+    queue = WorkQueue(queue_path, max_attempts=1)
+    jobs = make_jobs(2)
+    queue.add(jobs, save_path)
+    (first, _), (second, _) = queue.lease("w", 2)
+    queue.complete("w", first, [dict(id_num=0, task_id="BigCodeBench/0", synthesis="api0-0")])
+    queue.release("w", [second])
+    assert queue.export() is None
+
+    # A --resume run queues the failed job again, then asks for more samples of the exported one
+    stats = run_queue(Progress(), EchoModel(), jobs, queue_path, save_path)
+    assert stats["completed"] == 1
+    assert [row["synthesis"] for row in read(save_path)] == ["api0-0", "api1-0", "api1-1"]
+    jobs = [dict(jobs[0], start_index=1)]
+    assert queue.add(jobs, save_path) == 1
+    run_queue(Progress(), EchoModel(), jobs, queue_path, save_path)
+    assert [row["synthesis"] for row in read(save_path)] == ["api0-0", "api0-1", "api0-2", "api1-0", "api1-1"]
+
+
+def test_export_that_died_is_completed_once(tmp_path, monkeypatch):
+    queue_path, save_path = str(tmp_path / "queue.db"), str(tmp_path / "out.jsonl")
+    queue = WorkQueue(queue_path)
+    queue.add(make_jobs(1), save_path)
+    (item_id, _), = queue.lease("w", 1)
+    queue.complete("w", item_id, [dict(id_num=0, task_id="BigCodeBench/0", synthesis="api0-0")])
+
+    def die(*args):
+        raise KeyboardInterrupt
+
+    with monkeypatch.context() as m:
+        m.setattr("work_queue.os.replace", die)
+        try:
+            queue.export()
+        except KeyboardInterrupt:
+            pass
+    assert not (tmp_path / "out.jsonl").exists()
+    assert queue.export() is None
+    assert queue.export() is None
+    assert [row["synthesis"] for row in read(save_path)] == ["api0-0"]
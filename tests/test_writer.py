@@ -0,0 +1,29 @@
+import os
+import subprocess
+import sys
+
+from utils import load_resume_index
+from writer import WriterPool
+
+KILLED_RUN = """
+import os, sys
+from writer import WriterPool
+pool = WriterPool(flush_interval=60)
+pool.write(sys.argv[1], [dict(task_id="BigCodeBench/1", id_num=0, synthesis=str(k)) for k in range(3)])
+pool.writers[sys.argv[1]].flush()
+pool.write(sys.argv[1], [dict(task_id="BigCodeBench/1", id_num=0, synthesis="lost")])
+os._exit(1)
+"""
+
+
+def test_gzip_output_survives_a_killed_run(tmp_path):
+    path = str(tmp_path / "out.jsonl.gz")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    ret = subprocess.run([sys.executable, "-c", KILLED_RUN, path], cwd=root)
+    assert ret.returncode == 1
+    assert load_resume_index(path) == {("BigCodeBench/1", 0): 3}
+
+    # A resumed run appends after what the killed one left behind
+    with WriterPool() as pool:
+        pool.write(path, [dict(task_id="BigCodeBench/1", id_num=0, synthesis="3")])
+    assert load_resume_index(path) == {("BigCodeBench/1", 0): 4}
@@ -2,7 +2,10 @@ import json
 import os
 from typing import Iterable, Dict
 import gzip
-from datasets import load_dataset
+import hashlib
+from collections import Counter
+from canonical import canonicalize_schema
+from task_store import TASK_STORE_PATH, TaskStore, build_task_store, is_valid_store, load_dataset_records
 
 def write_jsonl(
     filename: str, data: Iterable[Dict], append: bool = False, drop_builtin: bool = True
@@ -29,16 +32,92 @@ def write_jsonl(
                     x = {k: v for k, v in x.items() if not k.startswith("_")}
                 fp.write((json.dumps(x) + "\n").encode("utf-8"))
     
+def _resume_index_path(filename: str) -> str:
+    return filename + ".idx.json"
+
+
+def _file_head_digest(filename: str, size: int) -> str:
+    with open(filename, "rb") as fp:
+        return hashlib.sha1(fp.read(min(size, 4096))).hexdigest()
+
+
+def _count_samples(lines, counts: Counter):
+    for line in lines:
+        if not line.strip():
+            continue
+        x = json.loads(line)
+        counts[(x["task_id"], x["id_num"])] += 1
+    return counts
+
+
+def load_resume_index(filename: str) -> Counter:
+    """
+    Counts the existing samples per (task_id, id_num), parsing each line once.
+    A sidecar index written by `save_resume_index` lets only the appended tail be parsed.
+    """
+    filename = os.path.expanduser(filename)
+    counts = Counter()
+    if not os.path.exists(filename):
+        return counts
+    if filename.endswith(".gz"):
+        with gzip.open(filename, "rt") as fp:
+            return _count_samples(fp, counts)
+
+    size = os.path.getsize(filename)
+    offset = 0
+    index_path = _resume_index_path(filename)
+    if os.path.exists(index_path):
+        with open(index_path, "r") as fp:
+            index = json.load(fp)
+        # The index is only valid if the file has been appended to since it was written
+        if index["size"] <= size and index["head"] == _file_head_digest(filename, index["size"]):
+            counts.update({(task_id, id_num): n for task_id, id_num, n in index["counts"]})
+            offset = index["size"]
+    with open(filename, "rb") as fp:
+        fp.seek(offset)
+        return _count_samples(fp, counts)
+
+
+def save_resume_index(filename: str, counts: Counter):
+    filename = os.path.expanduser(filename)
+    if filename.endswith(".gz") or not os.path.exists(filename):
+        return
+    size = os.path.getsize(filename)
+    index = dict(
+        size=size,
+        head=_file_head_digest(filename, size),
+        counts=[[task_id, id_num, n] for (task_id, id_num), n in counts.items()],
+    )
+    tmp_path = _resume_index_path(filename) + ".tmp"
+    with open(tmp_path, "w") as fp:
+        json.dump(index, fp)
+    os.replace(tmp_path, _resume_index_path(filename))
+
+
+def drop_resume_index(filename: str):
+    """Before a file is rewritten rather than appended to, which its index could not tell."""
+    try:
+        os.remove(_resume_index_path(os.path.expanduser(filename)))
+    except FileNotFoundError:
+        pass
+
+
 def load_api_schema():
     with open("apis_info_grouped_schema_split.jsonl", "r") as f:
-        return [json.loads(line) for line in f]
-
-def load_example():
-    ds = load_dataset("bigcode/bigcodebench-hard", split="v0.1.0_hf")
-    ds_dict = dict()
-    for sample in ds:
-        ds_dict[sample["task_id"]] = sample["code_prompt"] + sample["canonical_solution"]
-    return ds_dict
+        schemas = [json.loads(line) for line in f]
+    # Older stores embed memory addresses, which would make every prompt unique per run
+    for schema in schemas:
+        schema["data"] = canonicalize_schema(schema["data"])
+    return schemas
+
+def load_example(path: str = TASK_STORE_PATH) -> TaskStore:
+    """
+    task_id -> code_prompt + canonical_solution, served from the local task store. The
+    store is built from the Hugging Face dataset on first use, or again if it is incomplete.
+    """
+    if not is_valid_store(path):
+        build_task_store(load_dataset_records(), path)
+    return TaskStore(path)
 
 def validator(data):
     new_data = []
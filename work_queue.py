@@ -0,0 +1,334 @@
+import os
+import gzip
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import argparse
+import threading
+import contextlib
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from rich.progress import Progress
+
+from pipeline import build_samples, make_request
+from utils import write_jsonl, save_resume_index, drop_resume_index
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    template TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    id_num INTEGER NOT NULL,
+    job TEXT NOT NULL,
+    save_path TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (template, task_id, id_num)
+);
+CREATE INDEX IF NOT EXISTS items_state ON items (state, id);
+CREATE TABLE IF NOT EXISTS results (
+    item_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    row TEXT NOT NULL,
+    PRIMARY KEY (item_id, seq)
+);
+CREATE TABLE IF NOT EXISTS replacements (
+    tmp_path TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    counts TEXT NOT NULL
+);
+"""
+
+
+def read_rows(path: str) -> List[Dict]:
+    if not os.path.exists(path):
+        return []
+    with (gzip.open(path, "rt") if path.endswith(".gz") else open(path, "r")) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class WorkQueue:
+    """
+    Jobs of (template, task_id, id_num) in a SQLite file shared by the workers of a run.
+    A worker leases a batch of pending items for `lease_s` seconds and keeps the lease alive
+    with heartbeats; items of a worker that dies are leased again once their lease expires.
+    The rows of an item are stored in the same transaction that marks it done, and only while
+    the worker still holds the item, so each item is committed exactly once, and exported once.
+    """
+
+    def __init__(self, path: str, lease_s: float = 600.0, max_attempts: int = 3) -> None:
+        self.path = path
+        self.lease_s = lease_s
+        self.max_attempts = max_attempts
+        self.db = self.connect()
+        self.db.executescript(SCHEMA)
+
+    def connect(self) -> sqlite3.Connection:
+        # Transactions are explicit, BEGIN IMMEDIATE taking the write lock up front
+        db = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    @contextlib.contextmanager
+    def transaction(self, db: sqlite3.Connection = None):
+        db = db or self.db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def add(self, jobs: List[Dict], save_path: str) -> int:
+        """
+        Adds the jobs that are not in the queue yet; every worker of a run can call this. A job
+        that failed, or that was done before and comes back with other parameters, e.g. the
+        samples a --resume run still misses, is pending again.
+        """
+        n_added = 0
+        with self.transaction() as db:
+            for job in jobs:
+                key = (job.get("template"), job["task_id"], job["id_num"])
+                data, path = json.dumps(job), job.get("save_path", save_path)
+                item = db.execute(
+                    "SELECT id, state, job FROM items WHERE template = ? AND task_id = ? AND id_num = ?", key
+                ).fetchone()
+                if item is None:
+                    db.execute(
+                        "INSERT INTO items (template, task_id, id_num, job, save_path) VALUES (?, ?, ?, ?, ?)",
+                        (*key, data, path),
+                    )
+                elif item[1] == "failed" or (item[1] in ("done", "exported") and item[2] != data):
+                    db.execute("DELETE FROM results WHERE item_id = ?", (item[0],))
+                    db.execute(
+                        "UPDATE items SET state = 'pending', job = ?, save_path = ?, owner = NULL, attempts = 0 WHERE id = ?",
+                        (data, path, item[0]),
+                    )
+                else:
+                    continue
+                n_added += 1
+        return n_added
+
+    def lease(self, worker: str, n: int) -> List[Tuple[int, Dict]]:
+        now = time.time()
+        with self.transaction() as db:
+            db.execute(
+                "UPDATE items SET state = 'pending', owner = NULL WHERE state = 'leased' AND lease_until < ?",
+                (now,),
+            )
+            rows = db.execute(
+                "SELECT id, job FROM items WHERE state = 'pending' ORDER BY id LIMIT ?", (n,)
+            ).fetchall()
+            db.executemany(
+                "UPDATE items SET state = 'leased', owner = ?, lease_until = ? WHERE id = ?",
+                [(worker, now + self.lease_s, item_id) for item_id, _ in rows],
+            )
+        return [(item_id, json.loads(job)) for item_id, job in rows]
+
+    def heartbeat(self, worker: str, db: sqlite3.Connection = None):
+        with self.transaction(db) as db:
+            db.execute(
+                "UPDATE items SET lease_until = ? WHERE state = 'leased' AND owner = ?",
+                (time.time() + self.lease_s, worker),
+            )
+
+    def complete(self, worker: str, item_id: int, rows: List[Dict]) -> bool:
+        """Stores the rows of an item and marks it done; False if another worker got it in the meantime."""
+        with self.transaction() as db:
+            # An expired lease that nobody took over yet is still safe to complete
+            state = db.execute(
+                "SELECT state FROM items WHERE id = ? AND (state = 'pending' OR (state = 'leased' AND owner = ?))",
+                (item_id, worker),
+            ).fetchone()
+            if state is None:
+                return False
+            db.executemany(
+                "INSERT INTO results (item_id, seq, row) VALUES (?, ?, ?)",
+                [(item_id, seq, json.dumps(row)) for seq, row in enumerate(rows)],
+            )
+            db.execute("UPDATE items SET state = 'done', owner = NULL WHERE id = ?", (item_id,))
+        return True
+
+    def release(self, worker: str, item_ids: List[int]):
+        """Returns the items of a failed batch; an item that keeps failing is set aside as failed."""
+        with self.transaction() as db:
+            db.executemany(
+                "UPDATE items SET attempts = attempts + 1, owner = NULL, "
+                "state = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END "
+                "WHERE id = ? AND state = 'leased' AND owner = ?",
+                [(self.max_attempts, item_id, worker) for item_id in item_ids],
+            )
+
+    def next_expiry(self) -> Optional[float]:
+        """When the first lease that another worker holds runs out, None if no item is leased."""
+        return self.db.execute("SELECT MIN(lease_until) FROM items WHERE state = 'leased'").fetchone()[0]
+
+    def counts(self) -> Counter:
+        return Counter(dict(self.db.execute("SELECT state, COUNT(*) FROM items GROUP BY state").fetchall()))
+
+    def export(self, save_path: str = None, allow_failed: bool = False) -> Optional[Counter]:
+        """
+        Merges the rows of the done items into their output files, or all of them into
+        `save_path`, after the rows those files already hold, e.g. the samples a --resume run
+        did not queue again. Only a drained queue is exported, and not while items have failed
+        unless `allow_failed`. The merged files are recorded in the transaction that marks the
+        items exported and moved into place afterwards, by the next export if this one dies
+        in between, so that no row is exported twice. Returns None if nothing was exported.
+        """
+        with self.transaction() as db:
+            self.replace_exported(db)
+            counts = Counter(dict(db.execute("SELECT state, COUNT(*) FROM items GROUP BY state").fetchall()))
+            if counts["pending"] or counts["leased"] or not counts["done"] or (counts["failed"] and not allow_failed):
+                return None
+            outputs = {}
+            query = (
+                "SELECT items.save_path, results.row FROM results JOIN items ON items.id = results.item_id "
+                "WHERE items.state = 'done' ORDER BY items.id_num, items.id, results.seq"
+            )
+            for path, row in db.execute(query):
+                outputs.setdefault(save_path or path, []).append(json.loads(row))
+            n_rows = Counter()
+            for path, rows in outputs.items():
+                # The sort is stable, so the existing samples of a schema stay before the new ones
+                rows = sorted(read_rows(path) + rows, key=lambda row: row["id_num"])
+                dirname, basename = os.path.split(path)
+                tmp_path = os.path.join(dirname, f".tmp-{uuid.uuid4().hex[:8]}-{basename}")
+                write_jsonl(tmp_path, rows)
+                index = Counter((row["task_id"], row["id_num"]) for row in rows)
+                db.execute(
+                    "INSERT INTO replacements (tmp_path, path, counts) VALUES (?, ?, ?)",
+                    (tmp_path, path, json.dumps([[task_id, id_num, n] for (task_id, id_num), n in index.items()])),
+                )
+                n_rows[path] = len(rows)
+            db.execute("UPDATE items SET state = 'exported' WHERE state = 'done'")
+        with self.transaction() as db:
+            self.replace_exported(db)
+        return n_rows
+
+    def replace_exported(self, db: sqlite3.Connection):
+        """Moves the recorded files of committed exports into place; a file that was moved already is gone."""
+        for tmp_path, path, counts in db.execute("SELECT tmp_path, path, counts FROM replacements").fetchall():
+            if os.path.exists(tmp_path):
+                # A resume index of the replaced file would no longer match it
+                drop_resume_index(path)
+                os.replace(tmp_path, path)
+                save_resume_index(path, Counter({(task_id, id_num): n for task_id, id_num, n in json.loads(counts)}))
+            db.execute("DELETE FROM replacements WHERE tmp_path = ?", (tmp_path,))
+
+
+class Heartbeat:
+    """Renews the leases of a worker from a background thread while it generates."""
+
+    def __init__(self, queue: WorkQueue, worker: str) -> None:
+        self.queue = queue
+        self.worker = worker
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        db = self.queue.connect()
+        while not self.stopped.wait(self.queue.lease_s / 3):
+            self.queue.heartbeat(self.worker, db)
+        db.close()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+
+def run_queue(
+    p: Progress,
+    model,
+    jobs: List[Dict],
+    queue_path: str,
+    save_path: str,
+    do_sample: bool = True,
+    lease_size: int = 16,
+    lease_s: float = 600.0,
+    poll_s: float = 10.0,
+) -> Counter:
+    """
+    Adds `jobs` to the queue, then leases and generates batches of items until the queue is
+    drained, whichever worker added them. A failed batch is returned to the queue before the
+    error is raised. While other workers hold the last items, the worker polls every `poll_s`
+    seconds, at most until their leases run out, so that it takes over the items of a worker
+    that died. Once nothing is pending or leased, the results are exported.
+    """
+    queue = WorkQueue(queue_path, lease_s=lease_s)
+    worker = worker_name()
+    n_added = queue.add(jobs, save_path)
+    p.console.print(f"Worker {worker}: added {n_added} of {len(jobs)} jobs to {queue_path}, {dict(queue.counts())}")
+
+    stats = Counter()
+    with Heartbeat(queue, worker):
+        while True:
+            items = queue.lease(worker, lease_size)
+            if not items:
+                expiry = queue.next_expiry()
+                if expiry is None:
+                    break
+                time.sleep(min(poll_s, max(0.0, expiry - time.time())))
+                continue
+            try:
+                outputs = model.codegen_batch([make_request(job) for _, job in items], do_sample=do_sample)
+            except BaseException:
+                queue.release(worker, [item_id for item_id, _ in items])
+                raise
+            for (item_id, job), completions in zip(items, outputs):
+                if not completions:
+                    # Its requests failed for good; the item goes back to the queue like a failed batch
+                    queue.release(worker, [item_id])
+                    stats["failed"] += 1
+                elif queue.complete(worker, item_id, build_samples(job, completions)):
+                    stats["completed"] += 1
+                else:
+                    stats["lost_lease"] += 1
+            p.console.print(f"Worker {worker}: {dict(stats)}, queue {dict(queue.counts())}")
+
+    exported = queue.export()
+    for path, n_rows in (exported or {}).items():
+        p.console.print(f"Queue drained: exported {n_rows} rows to {path}")
+    if queue.counts()["failed"]:
+        p.console.print(
+            f"Queue not exported: {queue.counts()['failed']} items failed, a --resume run queues them again, "
+            f"or export with --allow_failed"
+        )
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["status", "export"])
+    parser.add_argument("queue_path", type=str)
+    parser.add_argument("--save_path", default=None, type=str, help="Export every row here instead of each job's own output")
+    parser.add_argument("--allow_failed", action="store_true", help="Export even though some items failed")
+    args = parser.parse_args()
+
+    queue = WorkQueue(args.queue_path)
+    if args.command == "status":
+        print(dict(queue.counts()))
+    else:
+        exported = queue.export(args.save_path, allow_failed=args.allow_failed)
+        if exported is None:
+            print(f"Nothing exported: the queue is not drained, has failed items or was exported before, {dict(queue.counts())}")
+        for path, n_rows in (exported or {}).items():
+            print(f"Exported {n_rows} rows to {path}")
+
+
+if __name__ == "__main__":
+    main()
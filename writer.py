@@ -0,0 +1,147 @@
+import os
+import gzip
+import json
+import time
+import queue
+import threading
+from typing import Dict, Iterable
+
+
+class JsonlWriter:
+    """
+    Appends records to a .jsonl or .jsonl.gz file from a background thread, through one
+    open handle for the whole run. Records are buffered and flushed once `flush_bytes` are
+    pending or `flush_interval` seconds have passed, and fsynced if `fsync` is set. Each
+    flush of a .gz file is a complete gzip member, so a run that is killed leaves a file
+    that can still be read and resumed. `close` drains the buffer and fsyncs.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        append: bool = True,
+        flush_bytes: int = 1 << 20,
+        flush_interval: float = 1.0,
+        fsync: bool = False,
+        drop_builtin: bool = True,
+    ) -> None:
+        self.filename = os.path.expanduser(filename)
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.drop_builtin = drop_builtin
+        self.fp = open(self.filename, "ab" if append else "wb")
+        self.gz = self.filename.endswith(".gz")
+        self.queue = queue.Queue()
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name=f"writer:{self.filename}", daemon=True)
+        self.thread.start()
+
+    def write(self, records: Iterable[Dict]):
+        self._check()
+        self.queue.put(list(records))
+
+    def flush(self):
+        """Blocks until every record written so far has reached the file."""
+        self._check()
+        done = threading.Event()
+        self.queue.put(done)
+        while not done.wait(0.1) and self.thread.is_alive():
+            pass
+        self._check()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+        self._check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _check(self):
+        if self.error is not None:
+            raise RuntimeError(f"Writing {self.filename} failed") from self.error
+
+    def _run(self):
+        buffer, n_bytes, deadline = [], 0, None
+        try:
+            while True:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    self._write(buffer)
+                    buffer, n_bytes, deadline = [], 0, None
+                    continue
+                if isinstance(item, list):
+                    for x in item:
+                        if self.drop_builtin:
+                            x = {k: v for k, v in x.items() if not k.startswith("_")}
+                        line = (json.dumps(x) + "\n").encode("utf-8")
+                        buffer.append(line)
+                        n_bytes += len(line)
+                    if buffer and deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+                    if n_bytes >= self.flush_bytes:
+                        self._write(buffer)
+                        buffer, n_bytes, deadline = [], 0, None
+                    continue
+                # flush() or close(): drain everything pending
+                self._write(buffer)
+                buffer, n_bytes, deadline = [], 0, None
+                if item is None:
+                    self.fp.flush()
+                    os.fsync(self.fp.fileno())
+                    self.fp.close()
+                    return
+                item.set()
+        except BaseException as e:
+            self.error = e
+            self.fp.close()
+
+    def _write(self, buffer):
+        if buffer:
+            if self.gz:
+                with gzip.GzipFile(fileobj=self.fp, mode="wb") as stream:
+                    stream.write(b"".join(buffer))
+            else:
+                self.fp.write(b"".join(buffer))
+            self.fp.flush()
+            if self.fsync:
+                os.fsync(self.fp.fileno())
+
+
+class WriterPool:
+    """One JsonlWriter per output file, opened on first use."""
+
+    def __init__(self, **kwargs) -> None:
+        self.kwargs = kwargs
+        self.writers: Dict[str, JsonlWriter] = {}
+
+    def write(self, filename: str, records: Iterable[Dict]):
+        if filename not in self.writers:
+            self.writers[filename] = JsonlWriter(filename, **self.kwargs)
+        self.writers[filename].write(records)
+
+    def close(self):
+        errors = []
+        for writer in self.writers.values():
+            try:
+                writer.close()
+            except RuntimeError as e:
+                errors.append(e)
+        if errors:
+            raise errors[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()